@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+import fitz
+
+
+class DocumentHandle:
+    def __init__(self, digest, path, plumber_loader=None):
+        self.digest = digest
+        self.path = path
+        self.doc = fitz.open(path)
+        # fitz and pdfplumber objects are not thread safe, sessions sharing a document take these locks
+        self.lock = threading.RLock()
+        self.plumber_lock = threading.RLock()
+        self.plumber_loader = plumber_loader
+        self._plumber = None
+        self.refs = 0
+        self.last_used = time.monotonic()
+
+    def plumber(self):
+        with self.plumber_lock:
+            if self._plumber is None:
+                self._plumber = self.plumber_loader().open(self.path)
+            return self._plumber
+
+    def close(self):
+        with self.lock:
+            self.doc.close()
+        with self.plumber_lock:
+            if self._plumber is not None:
+                self._plumber.close()
+                self._plumber = None
+
+
+class DocumentPool:
+    # open documents keyed by content hash, shared by every session that uploaded the same file
+    def __init__(self, idle_seconds=None, max_idle=None, plumber_loader=None):
+        self.idle_seconds = float(idle_seconds if idle_seconds is not None else os.getenv('DOC_POOL_IDLE_SECONDS', 600))
+        self.max_idle = int(max_idle if max_idle is not None else os.getenv('DOC_POOL_MAX_IDLE', 8))
+        self.plumber_loader = plumber_loader
+        self.handles = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, digest, path):
+        with self.lock:
+            handle = self.handles.get(digest)
+            if handle is None:
+                handle = DocumentHandle(digest, path, self.plumber_loader)
+                self.handles[digest] = handle
+            handle.refs += 1
+            handle.last_used = time.monotonic()
+            self._evict_idle()
+            return handle
+
+    def release(self, handle):
+        with self.lock:
+            handle.refs = max(0, handle.refs - 1)
+            handle.last_used = time.monotonic()
+            self._evict_idle()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        idle = sorted((h for h in self.handles.values() if h.refs == 0), key=lambda h: h.last_used)
+        for i, handle in enumerate(idle):
+            if now - handle.last_used > self.idle_seconds or len(idle) - i > self.max_idle:
+                del self.handles[handle.digest]
+                handle.close()
+
+    def lock_for(self, doc):
+        with self.lock:
+            for handle in self.handles.values():
+                if handle.doc is doc:
+                    return handle.lock
+        return None
+
+    def digests(self):
+        with self.lock:
+            return set(self.handles)
+
+    def evict_idle(self):
+        with self.lock:
+            self._evict_idle()
+
+    def close(self):
+        with self.lock:
+            for handle in self.handles.values():
+                handle.close()
+            self.handles.clear()
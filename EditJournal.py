@@ -0,0 +1,143 @@
+import os
+import re
+import zlib
+
+from TextNormalizer import TextNormalizer, GLUE_SRC, DIACRITICS
+
+# A patch turns an edited text back into the original: a list of (start, end, old) where
+# text[start:end] of the edited text is replaced with old. Edits build it in the same pass
+# that produces the new text, so only the changed pieces are kept.
+
+
+def text_checksum(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def diff(old, new):
+    # fallback for edits that can't report their own changes: trims the common prefix and suffix
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    return [(prefix, len(new) - suffix, old[prefix:len(old) - suffix])]
+
+
+def revert(text, patch):
+    pieces = []
+    pos = 0
+    for start, end, old in patch:
+        pieces.append(text[pos:start])
+        pieces.append(old)
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
+class RegexEdit:
+    # replaces every match of pattern with a literal string
+    def __init__(self, pattern, repl):
+        self.pattern = re.compile(pattern)
+        self.repl = repl
+
+    def apply(self, text):
+        pieces = []
+        patch = []
+        pos = 0
+        shift = 0
+        for m in self.pattern.finditer(text):
+            if m.start() == m.end():
+                continue
+            pieces.append(text[pos:m.start()])
+            pieces.append(self.repl)
+            start = m.start() + shift
+            patch.append((start, start + len(self.repl), m.group()))
+            shift += len(self.repl) - (m.end() - m.start())
+            pos = m.end()
+        if not patch:
+            return text, None
+        pieces.append(text[pos:])
+        return ''.join(pieces), patch
+
+
+class TranslateEdit:
+    # character mapping through a TextNormalizer, chars lists every character it may change
+    def __init__(self, normalizer, chars):
+        self.normalizer = normalizer
+        self.pattern = re.compile('[' + re.escape(chars) + ']+')
+
+    def apply(self, text):
+        new = self.normalizer.normalize(text)
+        if new == text:
+            return text, None
+        if len(new) != len(text):
+            return new, diff(text, new)
+        return new, [(m.start(), m.end(), m.group()) for m in self.pattern.finditer(text)
+                     if new[m.start():m.end()] != m.group()]
+
+
+def remove_diacritics_edit():
+    return RegexEdit(' ?[' + DIACRITICS + ']+', '')
+
+
+def replace_edit(old, new):
+    return RegexEdit(re.escape(old), new)
+
+
+def glue_edit():
+    return TranslateEdit(TextNormalizer.shared(["glue"]), GLUE_SRC + chr(172))
+
+
+class EditJournal:
+    def __init__(self, max_entries=None):
+        self.max_entries = int(max_entries if max_entries is not None else os.getenv('EDIT_JOURNAL_SIZE', 20))
+        self.entries = []
+
+    def apply(self, label, pages, page_indices, source_key, edit):
+        # runs edit over pages[i] for i in page_indices, writing "edited_text" and journaling a patch per changed page
+        changes = []
+        for i in page_indices:
+            page = pages[i]
+            had_edited = "edited_text" in page
+            text = page["edited_text"] if had_edited else page.get(source_key)
+            if not text:
+                continue
+            new, patch = edit.apply(text)
+            if patch is None:
+                continue
+            page["edited_text"] = new
+            changes.append((i, had_edited, patch, text_checksum(new)))
+        if changes:
+            self.entries.append((label, changes))
+            del self.entries[:-self.max_entries]
+        return [i for i, _, _, _ in changes]
+
+    def can_undo(self):
+        return len(self.entries) > 0
+
+    def last_label(self):
+        return self.entries[-1][0] if self.entries else None
+
+    def undo(self, pages):
+        # returns (reverted, skipped) page indices; pages edited again since the edit are left alone
+        if not self.entries:
+            return [], []
+        _, changes = self.entries.pop()
+        reverted, skipped = [], []
+        for i, had_edited, patch, checksum in changes:
+            page = pages[i]
+            text = page.get("edited_text")
+            if text is None or text_checksum(text) != checksum:
+                skipped.append(i)
+                continue
+            if had_edited:
+                page["edited_text"] = revert(text, patch)
+            else:
+                del page["edited_text"]
+            reverted.append(i)
+        return reverted, skipped
+
+    def size(self):
+        return sum(len(old) for _, changes in self.entries for _, _, patch, _ in changes for _, _, old in patch)
@@ -0,0 +1,120 @@
+import sqlite3
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+
+
+class ExtractionCache:
+    def __init__(self, path=None, max_mb=None):
+        cache_dir = os.getenv('CACHE_DIR', '.cache')
+        self.path = path or os.path.join(cache_dir, 'extraction.sqlite3')
+        self.max_bytes = int(max_mb if max_mb is not None else os.getenv('EXTRACTION_CACHE_MB', 512)) * 1024 * 1024
+        self.lock = threading.Lock()
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+        # key -> last hit, written in batches so a hit is a read only; LRU order only needs to be roughly right
+        self.accessed = {}
+        self.accessed_flushed = time.time()
+        self.access_batch = int(os.getenv('CACHE_ACCESS_BATCH', 256))
+        self.access_seconds = float(os.getenv('CACHE_ACCESS_SECONDS', 60))
+        if self.max_bytes <= 0: # cache disabled
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self.lock, self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.total = self._stored_bytes()
+
+    @staticmethod
+    def hash_file(pdf_path):
+        # the file is mapped instead of read in blocks, hashlib works on the pages straight from the page cache
+        with open(pdf_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.sha256().hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return hashlib.sha256(mapped).hexdigest()
+
+    @staticmethod
+    def make_key(doc_hash, page, method, params):
+        raw = json.dumps([doc_hash, page, method, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _stored_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        if self.conn is None:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT text FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            self.accessed[key] = now
+            if len(self.accessed) >= self.access_batch or now - self.accessed_flushed > self.access_seconds:
+                with self.conn:
+                    self._flush_accessed()
+        return row[0]
+
+    def put(self, key, text):
+        if self.conn is None or text is None:
+            return
+        size = len(text.encode('utf-8'))
+        with self.lock, self.conn:
+            self._flush_accessed()
+            self.conn.execute("INSERT OR REPLACE INTO entries (key, text, size, accessed) VALUES (?, ?, ?, ?)",
+                              (key, text, size, time.time()))
+            self.total += size
+            if self.total > self.max_bytes:
+                self._evict()
+
+    def _flush_accessed(self):
+        # inside the caller's transaction
+        if self.accessed:
+            self.conn.executemany("UPDATE entries SET accessed = ? WHERE key = ?", [(t, k) for k, t in self.accessed.items()])
+            self.accessed = {}
+        self.accessed_flushed = time.time()
+
+    def _evict(self):
+        # other processes may share the file, so recount before dropping the least recently used rows
+        self.total = self._stored_bytes()
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall()
+        dropped = []
+        for key, size in rows:
+            if self.total <= target:
+                break
+            dropped.append((key,))
+            self.total -= size
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", dropped)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.total if self.conn is not None else 0}
+
+    def clear(self):
+        if self.conn is None:
+            return
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.accessed = {}
+            self.total = 0
+
+    def close(self):
+        if self.conn is None:
+            return
+        with self.lock:
+            with self.conn:
+                self._flush_accessed()
+            self.conn.close()
+            self.conn = None
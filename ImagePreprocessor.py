@@ -0,0 +1,165 @@
+import math
+import os
+import time
+
+import fitz
+import numpy as np
+from PIL import Image
+
+# part of the OCR cache keys while preprocessing is on, bumped when its output changes
+PREPROCESS_VERSION = 1
+
+
+class OCRImage:
+    # a preprocessed page and what was done to it, so OCR boxes can be mapped back to the render space
+    __slots__ = ("image", "page_width", "scale", "angle", "center", "offset", "timings")
+
+    def __init__(self, image, page_width, scale, angle, center, offset, timings):
+        self.image = image
+        self.page_width = page_width
+        self.scale = scale
+        self.angle = angle
+        self.center = center
+        self.offset = offset
+        self.timings = timings
+
+    def to_render_space(self, boxes, zoom=2):
+        # boxes (n, 4) in image pixels -> the zoom render the viewer and col_center use
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return boxes
+        x = boxes[:, [0, 2, 2, 0]] + self.offset[0]
+        y = boxes[:, [1, 1, 3, 3]] + self.offset[1]
+        if self.angle:
+            # undo the deskew rotation around the image centre
+            a = math.radians(self.angle)
+            dx, dy = x - self.center[0], y - self.center[1]
+            x = self.center[0] + dx * math.cos(a) - dy * math.sin(a)
+            y = self.center[1] + dx * math.sin(a) + dy * math.cos(a)
+        ratio = zoom / self.scale
+        return np.stack([x.min(1), y.min(1), x.max(1), y.max(1)], axis=1) * ratio
+
+
+class ImagePreprocessor:
+    # grayscale render at a scale picked per page from its text height, then Otsu binarisation,
+    # deskew and margin crop, all on NumPy arrays
+    def __init__(self, text_px=None, min_scale=None, max_scale=None, max_side=None, max_skew=None):
+        self.text_px = float(text_px if text_px is not None else os.getenv('OCR_TEXT_PX', 32))
+        self.min_scale = float(min_scale if min_scale is not None else os.getenv('OCR_MIN_SCALE', 1))
+        self.max_scale = float(max_scale if max_scale is not None else os.getenv('OCR_MAX_SCALE', 4))
+        self.max_side = int(max_side if max_side is not None else os.getenv('OCR_MAX_SIDE', 4000))
+        self.max_skew = float(max_skew if max_skew is not None else os.getenv('OCR_MAX_SKEW', 5))
+
+    def params(self, binary):
+        # part of the OCR cache keys: a change to any setting (or to the code, PREPROCESS_VERSION) is a new key
+        return {"version": PREPROCESS_VERSION, "binary": binary, "text_px": self.text_px, "min_scale": self.min_scale,
+                "max_scale": self.max_scale, "max_side": self.max_side, "max_skew": self.max_skew}
+
+    @staticmethod
+    def render_gray(page, scale):
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY)
+        return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+    @staticmethod
+    def otsu(gray):
+        hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+        levels = np.arange(256)
+        weight = np.cumsum(hist)
+        mean = np.cumsum(hist * levels)
+        total, total_mean = weight[-1], mean[-1]
+        background = total - weight
+        with np.errstate(divide='ignore', invalid='ignore'):
+            between = (total_mean * weight - mean * total) ** 2 / (weight * background)
+        between[~np.isfinite(between)] = 0
+        return int(np.argmax(between))
+
+    def text_height(self, page):
+        # line height in points: the font sizes of the text layer, or the ink runs of a low resolution render
+        sizes = [span["size"] for block in page.get_text("dict")["blocks"] for line in block.get("lines", [])
+                 for span in line["spans"] if span["text"].strip()]
+        if sizes:
+            return float(np.median(sizes))
+        gray = self.render_gray(page, 1)
+        ink = gray < self.otsu(gray)
+        rows = ink.sum(1) > max(1, ink.shape[1] // 100)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+        runs = edges[1::2] - edges[0::2]
+        runs = runs[runs > 2] # specks and rules
+        return float(np.median(runs)) if len(runs) else None
+
+    def pick_scale(self, page, text_height):
+        scale = self.text_px / text_height if text_height else 2.0
+        scale = min(max(scale, self.min_scale), self.max_scale)
+        return min(scale, self.max_side / max(page.rect.width, page.rect.height))
+
+    def skew_angle(self, ink, step=0.25, samples=20000):
+        # the angle whose projection profile has the sharpest peaks (text rows), from a sample of ink pixels
+        ys, xs = np.nonzero(ink)
+        if len(ys) < 100 or not self.max_skew:
+            return 0.0
+        if len(ys) > samples:
+            pick = np.random.default_rng(0).choice(len(ys), samples, replace=False)
+            ys, xs = ys[pick], xs[pick]
+        angles = np.arange(-self.max_skew, self.max_skew + step / 2, step)
+        shifted = np.rint(ys[None, :] - xs[None, :] * np.tan(np.radians(angles))[:, None]).astype(np.int64)
+        shifted -= shifted.min()
+        length = int(shifted.max()) + 1
+        flat = shifted + (np.arange(len(angles)) * length)[:, None]
+        profiles = np.bincount(flat.ravel(), minlength=len(angles) * length).reshape(len(angles), length)
+        return float(angles[np.argmax((profiles.astype(np.float64) ** 2).sum(1))])
+
+    @staticmethod
+    def crop_box(ink, pad):
+        rows = np.flatnonzero(ink.sum(1) > 1)
+        cols = np.flatnonzero(ink.sum(0) > 1)
+        if len(rows) == 0 or len(cols) == 0:
+            return 0, 0, ink.shape[1], ink.shape[0]
+        return (max(0, cols[0] - pad), max(0, rows[0] - pad),
+                min(ink.shape[1], cols[-1] + pad + 1), min(ink.shape[0], rows[-1] + pad + 1))
+
+    def process(self, page, binary=True):
+        # binary=True for tesseract, grayscale for the neural engines (surya, gemini)
+        return self.finish(page, *self.prepare(page), binary)
+
+    def process_both(self, page):
+        # (grayscale, binarised) from one render; the binarised one is the same as process(page, True) gives
+        prepared = self.prepare(page)
+        return self.finish(page, *prepared, False), self.finish(page, *prepared, True)
+
+    def prepare(self, page):
+        # the scaled render, its threshold and skew: what both the grayscale and the binarised outputs share
+        timings = {}
+        start = time.perf_counter()
+        scale = self.pick_scale(page, self.text_height(page))
+        timings["scale"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gray = self.render_gray(page, scale)
+        timings["render"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        threshold = self.otsu(gray)
+        ink = gray < threshold
+        timings["binarize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        angle = self.skew_angle(ink[::2, ::2])
+        timings["deskew"] = time.perf_counter() - start
+        return scale, gray, threshold, ink, angle, timings
+
+    def finish(self, page, scale, gray, threshold, ink, angle, timings, binary):
+        timings = dict(timings)
+        start = time.perf_counter()
+        pixels = np.where(ink, 0, 255).astype(np.uint8) if binary else gray
+        image = Image.fromarray(pixels, "L")
+        center = (image.width / 2, image.height / 2)
+        if angle:
+            image = image.rotate(angle, resample=Image.NEAREST if binary else Image.BILINEAR, fillcolor=255)
+            ink = np.asarray(image) < (128 if binary else threshold)
+        timings["deskew"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        box = self.crop_box(ink, pad=int(self.text_px))
+        image = image.crop(box)
+        timings["crop"] = time.perf_counter() - start
+        return OCRImage(image, page.rect.width, scale, angle, center, box[:2], timings)
@@ -0,0 +1,195 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# lower runs first
+PRIORITY_PAGE = 0
+PRIORITY_BOOK = 10
+
+
+class Job:
+    # pages of one document extracted in chunks by extract(pages) -> iterator of {"page", ...} records;
+    # records pile up in results until the session drains them
+    def __init__(self, job_id, extract, pages, label=None, priority=PRIORITY_BOOK, chunk_size=None,
+                 on_record=None, on_finish=None):
+        self.id = job_id
+        self.extract = extract
+        self.label = label
+        self.priority = priority
+        self.chunk_size = int(chunk_size or os.getenv('JOB_CHUNK_PAGES', 16))
+        self.on_record = on_record
+        self.on_finish = on_finish
+        self.total = len(pages)
+        self.remaining = deque(pages)
+        self.results = deque()
+        self.done = 0
+        self.state = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in ("done", "cancelled", "failed")
+
+    def take(self, page):
+        # removes a page not started yet, e.g. the one being looked at for a page job of its own; False when
+        # it is in the chunk running now or done
+        with self.lock:
+            if page not in self.remaining:
+                return False
+            self.remaining.remove(page)
+            self.total -= 1
+            return True
+
+    def next_chunk(self):
+        with self.lock:
+            return [self.remaining.popleft() for _ in range(min(self.chunk_size, len(self.remaining)))]
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def drain(self):
+        records = []
+        while self.results:
+            records.append(self.results.popleft())
+        return records
+
+    def progress(self):
+        elapsed = ((self.finished_at or time.time()) - self.started) if self.started else 0.0
+        return {
+            "id": self.id,
+            "label": self.label,
+            "state": self.state,
+            "done": self.done,
+            "total": self.total,
+            "pages_per_s": self.done / elapsed if elapsed else 0.0,
+            "error": self.error,
+        }
+
+
+class JobRunner:
+    # runs extraction jobs off the script thread, at most max_jobs chunks at a time for the whole server.
+    # a job runs one chunk, then goes back in the queue behind jobs of the same priority, so a job submitted
+    # later waits for a chunk to finish rather than for a whole book. one more thread is kept for PRIORITY_PAGE
+    # jobs, the page on screen starts right away even with max_jobs books running
+    def __init__(self, max_jobs=None, keep_seconds=None):
+        self.max_jobs = int(max_jobs if max_jobs is not None else os.getenv('JOB_MAX_CONCURRENT', 2))
+        self.keep_seconds = float(keep_seconds if keep_seconds is not None else os.getenv('JOB_KEEP_SECONDS', 600))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_jobs + 1, thread_name_prefix='job')
+        self.lock = threading.Lock()
+        self.queue = []
+        self.order = itertools.count()
+        self.ids = itertools.count(1)
+        self.running = 0
+        self.jobs = {}
+
+    def submit(self, extract, pages, label=None, priority=PRIORITY_BOOK, chunk_size=None, on_record=None, on_finish=None):
+        with self.lock:
+            self._forget_old()
+            job = Job(next(self.ids), extract, list(pages), label, priority, chunk_size, on_record, on_finish)
+            self.jobs[job.id] = job
+            heapq.heappush(self.queue, (job.priority, next(self.order), job))
+        self._dispatch()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        # a running job stops after its current page, a queued one right away
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.cancel()
+        with self.lock:
+            queued = [entry for entry in self.queue if entry[2] is job]
+            for entry in queued:
+                self.queue.remove(entry)
+            heapq.heapify(self.queue)
+        if queued:
+            self._finish(job, "cancelled")
+
+    def forget(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.finished:
+                del self.jobs[job_id]
+
+    def _forget_old(self):
+        # finished jobs nobody drained, e.g. of closed sessions
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.finished_at > self.keep_seconds:
+                del self.jobs[job_id]
+
+    def _dispatch(self):
+        with self.lock:
+            while self.queue:
+                priority = self.queue[0][0]
+                if self.running >= self.max_jobs + (1 if priority <= PRIORITY_PAGE else 0):
+                    break
+                _, _, job = heapq.heappop(self.queue)
+                self.running += 1
+                self.executor.submit(self._run_chunk, job)
+
+    def _run_chunk(self, job):
+        try:
+            state = "cancelled" if job.cancelled.is_set() else self._extract_chunk(job)
+        except Exception as e:
+            print(f'job {job.id} ({job.label}) failed: {e}')
+            job.error = str(e)
+            state = "failed"
+        with self.lock:
+            self.running -= 1
+            if state is None:
+                heapq.heappush(self.queue, (job.priority, next(self.order), job))
+        if state is not None:
+            self._finish(job, state)
+        self._dispatch()
+
+    def _extract_chunk(self, job):
+        # the job's final state, None when pages are left
+        if job.started is None:
+            job.started = time.time()
+            job.state = "running"
+        records = job.extract(job.next_chunk())
+        try:
+            for record in records:
+                job.results.append(record)
+                job.done += 1
+                if job.on_record:
+                    job.on_record(record)
+                if job.cancelled.is_set():
+                    break
+        finally:
+            # a generator stopped early cleans up (pending requests, worker pools) here
+            close = getattr(records, 'close', None)
+            if close:
+                close()
+        if job.cancelled.is_set():
+            return "cancelled"
+        return None if job.remaining else "done"
+
+    def _finish(self, job, state):
+        # outside self.lock, on_finish may be slow (closing files, releasing documents)
+        job.finished_at = time.time()
+        job.state = state
+        if job.on_finish:
+            try:
+                job.on_finish(job)
+            except Exception as e:
+                print(f'job {job.id} cleanup failed: {e}')
+
+    def shutdown(self):
+        with self.lock:
+            for _, _, job in self.queue:
+                job.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
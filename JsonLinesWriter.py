@@ -0,0 +1,50 @@
+import json
+import os
+
+
+class JsonLinesWriter:
+    # one json record per line, flushed as soon as it is written so a crash only loses the page in progress.
+    # mode 'w' starts the file over (a run over the whole book), 'a' adds to it (resumed or single pages)
+    def __init__(self, path, fsync=False, mode='a'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.fsync = fsync
+        self.file = open(path, mode, encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def write_all(self, records):
+        count = 0
+        for record in records:
+            self.write(record)
+            count += 1
+        return count
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def read(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by a crash
+                    continue
+
+    @staticmethod
+    def read_pages(path):
+        # {page: record}, the last record of a page wins when a resumed run wrote it again
+        return {record["page"]: record for record in JsonLinesWriter.read(path) if "page" in record}
@@ -0,0 +1,132 @@
+import json
+
+import numpy as np
+
+# bumped whenever layout() orders lines differently, it is part of the cache key of laid out text
+LAYOUT_VERSION = 1
+
+
+class PageLines:
+    # OCR / text layer lines of one page: boxes (n, 4) as x0, y0, x1, y1 in the 2x render space, text and confidence
+    __slots__ = ("boxes", "texts", "conf", "width")
+
+    def __init__(self, boxes, texts, conf=None, width=None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.texts = list(texts)
+        self.conf = np.asarray(conf if conf is not None else [1.0] * len(self.texts), dtype=np.float32)
+        self.width = float(width) if width else (float(self.boxes[:, 2].max()) if len(self.texts) else 0.0)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def to_json(self):
+        return json.dumps({
+            "width": self.width,
+            "boxes": np.round(self.boxes, 1).tolist(),
+            "texts": self.texts,
+            "conf": np.round(self.conf, 3).tolist(),
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls(data["boxes"], data["texts"], data["conf"], data["width"])
+
+
+def surya_lines(prediction, width=None):
+    lines = json.loads(prediction.json())['text_lines']
+    return PageLines([line['bbox'] for line in lines], [line['text'] for line in lines],
+                     [line.get('confidence') or 0.0 for line in lines], width)
+
+
+def tesseract_lines(data, width=None):
+    # data is image_to_data(..., output_type=Output.DICT); words are grouped into their lines
+    lines = {}
+    for i, word in enumerate(data['text']):
+        if not word or not word.strip():
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        x0, y0 = data['left'][i], data['top'][i]
+        box = (x0, y0, x0 + data['width'][i], y0 + data['height'][i])
+        conf = float(data['conf'][i])
+        if key not in lines:
+            lines[key] = [list(box), [word], [conf]]
+        else:
+            line = lines[key]
+            line[0] = [min(line[0][0], box[0]), min(line[0][1], box[1]), max(line[0][2], box[2]), max(line[0][3], box[3])]
+            line[1].append(word)
+            line[2].append(conf)
+    lines = list(lines.values())
+    return PageLines([line[0] for line in lines], [' '.join(line[1]) for line in lines],
+                     [max(0.0, sum(line[2]) / len(line[2])) / 100 for line in lines], width)
+
+
+def pymupdf_lines(words, scale=2, width=None):
+    # words is page.get_text("words"): (x0, y0, x1, y1, word, block, line, word_no), scaled to the render space
+    lines = {}
+    for x0, y0, x1, y1, word, block, line_no, _ in words:
+        key = (block, line_no)
+        if key not in lines:
+            lines[key] = [[x0, y0, x1, y1], [word]]
+        else:
+            line = lines[key]
+            line[0] = [min(line[0][0], x0), min(line[0][1], y0), max(line[0][2], x1), max(line[0][3], y1)]
+            line[1].append(word)
+    lines = list(lines.values())
+    return PageLines(np.asarray([line[0] for line in lines], dtype=np.float32).reshape(-1, 4) * scale,
+                     [' '.join(line[1]) for line in lines], None, width * scale if width else None)
+
+
+def detect_gutter(lines, min_gap=0.02, margin=0.2, noise=0.05):
+    # x of the widest vertical strip in the middle of the page that (almost) no line crosses,
+    # with lines on both sides of it; None for single column pages
+    if len(lines) < 4 or lines.width <= 0:
+        return None
+    width = int(np.ceil(lines.width))
+    x0 = np.clip(lines.boxes[:, 0].astype(np.int64), 0, width)
+    x1 = np.clip(np.ceil(lines.boxes[:, 2]).astype(np.int64), 0, width)
+    # lines covering each pixel column: +1 where a line starts, -1 where it ends, summed up
+    cover = np.cumsum(np.bincount(x0, minlength=width + 1) - np.bincount(x1, minlength=width + 1))[:width]
+
+    lo, hi = int(width * margin), int(width * (1 - margin))
+    free = np.zeros(width + 2, dtype=np.int8)
+    free[lo + 1:hi + 1] = cover[lo:hi] <= int(len(lines) * noise) # headers and page numbers may span the gutter
+    edges = np.flatnonzero(np.diff(free))
+    if len(edges) < 2:
+        return None
+    starts, ends = edges[0::2], edges[1::2]
+    best = np.argmax(ends - starts)
+    start, end = starts[best], ends[best]
+    if end - start < width * min_gap:
+        return None
+    if (lines.boxes[:, 2] <= start).sum() < 2 or (lines.boxes[:, 0] >= end).sum() < 2:
+        return None
+    return float(start + end) / 2
+
+
+def layout(lines, x=None):
+    # reading order from geometry: the right column before the left one, top to bottom,
+    # and right to left within a row; x of 0 or None detects the column split
+    if len(lines) == 0:
+        return ''
+    boxes = lines.boxes
+    if not x:
+        x = detect_gutter(lines)
+    if x:
+        # left column: lines mostly left of the split; lines straddling it (titles) are read with the right one
+        reach = np.minimum(x - boxes[:, 0], boxes[:, 2] - x)
+        straddles = reach > (boxes[:, 2] - boxes[:, 0]) / 4
+        column = (((boxes[:, 0] + boxes[:, 2]) / 2 < x) & ~straddles).astype(np.int8)
+    else:
+        column = np.zeros(len(lines), dtype=np.int8)
+
+    center = (boxes[:, 1] + boxes[:, 3]) / 2
+    height = float(np.median(boxes[:, 3] - boxes[:, 1])) or 1.0
+    # lines whose centres are within half a line height of the previous one share a row
+    by_y = np.lexsort((center, column))
+    gaps = np.diff(center[by_y]) > height / 2
+    new_column = np.diff(column[by_y]) != 0
+    row = np.empty(len(lines), dtype=np.int64)
+    row[by_y] = np.concatenate(([0], np.cumsum(gaps | new_column)))
+    order = np.lexsort((-boxes[:, 2], row))
+    return ''.join(lines.texts[i] + "\n" for i in order)
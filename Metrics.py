@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# top level span of a page, the other stages run inside it
+PAGE_STAGE = "extract"
+
+
+class Metrics:
+    # per-page timing spans of the pipeline stages and counters, kept in memory for the debug panel
+    # and the JSON / Prometheus text exporters; a span costs two perf_counter calls and an append
+    def __init__(self, max_spans=None, prefix="extractor"):
+        self.max_spans = int(max_spans if max_spans is not None else os.getenv('METRICS_MAX_SPANS', 20000))
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = deque(maxlen=self.max_spans)
+        # (stage, method) -> [count, seconds, max seconds], over every span ever recorded
+        self.stages = {}
+        # (name, sorted label items) -> value
+        self.counters = {}
+        # name -> callable returning {stat: value}, e.g. the caches' hit counts
+        self.collectors = {}
+
+    def labels(self):
+        # (doc, page, method) set by the innermost page() of this thread
+        return getattr(self.local, 'labels', (None, None, None))
+
+    def observe(self, stage, seconds, page=None, method=None, doc=None):
+        current = self.labels()
+        doc = doc if doc is not None else current[0]
+        page = page if page is not None else current[1]
+        method = method if method is not None else current[2]
+        with self.lock:
+            self.spans.append((stage, doc, page, method, seconds, time.time()))
+            totals = self.stages.setdefault((stage, method), [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+    @contextmanager
+    def span(self, stage, page=None, method=None, doc=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, page, method, doc)
+
+    @contextmanager
+    def page(self, page, method, doc=None):
+        # page is zero based; spans inside it without their own labels are counted for this page,
+        # errors escaping it are counted as backend errors. nested page()s (hybrid, parse_single_page
+        # around cached_extract) relabel their stages but only the outermost is timed
+        previous = self.labels()
+        outer = previous[1] is None
+        self.local.labels = (doc if doc is not None else previous[0], page, method)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if outer:
+                self.count("backend_errors", method=method, error=type(e).__name__)
+            raise
+        finally:
+            labels, self.local.labels = self.local.labels, previous
+            if outer:
+                self.observe(PAGE_STAGE, time.perf_counter() - start, page, method, labels[0])
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_collector(self, name, collect):
+        self.collectors[name] = collect
+
+    def take_spans(self):
+        # hands the recorded spans over, e.g. from a worker process to the parent's add_spans
+        with self.lock:
+            spans = list(self.spans)
+            self.spans.clear()
+        return spans
+
+    def add_spans(self, spans, doc=None):
+        for stage, span_doc, page, method, seconds, _ in spans:
+            self.observe(stage, seconds, page, method, doc if doc is not None else span_doc)
+
+    def page_stages(self, doc=None):
+        # {(doc, page, method): {stage: seconds}} of the spans still kept
+        pages = {}
+        with self.lock:
+            spans = list(self.spans)
+        for stage, span_doc, page, method, seconds, _ in spans:
+            if page is None or (doc is not None and span_doc != doc):
+                continue
+            stages = pages.setdefault((span_doc, page, method), {})
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        return pages
+
+    def slowest_pages(self, n=10, doc=None):
+        # pages by their extract span, or the sum of their stages when they ran elsewhere (workers, batches)
+        rows = []
+        for (span_doc, page, method), stages in self.page_stages(doc).items():
+            total = stages.get(PAGE_STAGE, sum(stages.values()))
+            row = {"page": page + 1, "method": method, "seconds": round(total, 4)}
+            row.update({stage: round(seconds, 4) for stage, seconds in stages.items() if stage != PAGE_STAGE})
+            rows.append(row)
+        rows.sort(key=lambda row: row["seconds"], reverse=True)
+        return rows[:n]
+
+    def collected(self):
+        stats = {}
+        for name, collect in list(self.collectors.items()):
+            try:
+                stats[name] = collect()
+            except Exception as e:
+                print(f'metrics collector {name} failed: {e}')
+        return stats
+
+    def counter_rows(self):
+        with self.lock:
+            return [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()]
+
+    def to_json(self):
+        with self.lock:
+            stages = [{"stage": stage, "method": method, "count": count, "seconds": round(total, 6), "max_seconds": round(longest, 6)}
+                      for (stage, method), (count, total, longest) in self.stages.items()]
+        return json.dumps({"stages": stages, "counters": self.counter_rows(), "collected": self.collected()}, ensure_ascii=False)
+
+    def to_prometheus(self):
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def label_text(items):
+            items = [(k, v) for k, v in items if v is not None]
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in items) + '}'
+
+        name = f"{self.prefix}_stage_seconds"
+        with self.lock:
+            stages = sorted(((key, tuple(totals)) for key, totals in self.stages.items()), key=str)
+            counters = sorted(self.counters.items(), key=str)
+        lines = [f"# TYPE {name} summary"]
+        for (stage, method), (count, total, _) in stages:
+            labels = label_text([("stage", stage), ("method", method)])
+            lines += [f"{name}_count{labels} {count}", f"{name}_sum{labels} {total:.6f}"]
+        lines.append(f"# TYPE {name}_max gauge")
+        for (stage, method), (_, _, longest) in stages:
+            lines.append(f"{name}_max{label_text([('stage', stage), ('method', method)])} {longest:.6f}")
+        typed = set()
+        for (counter, labels), value in counters:
+            full = f"{self.prefix}_{counter}_total"
+            if full not in typed:
+                lines.append(f"# TYPE {full} counter")
+                typed.add(full)
+            lines.append(f"{full}{label_text(labels)} {value}")
+        for source, stats in self.collected().items():
+            for stat, value in stats.items():
+                lines.append(f"{self.prefix}_{source}_{stat} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        # for a node_exporter textfile collector; METRICS_FILE, nothing when unset
+        path = path or os.getenv('METRICS_FILE')
+        if not path:
+            return
+        text = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.stages.clear()
+            self.counters.clear()
+
+
+# one per process, shared by every processor and session
+metrics = Metrics()
@@ -1,60 +1,456 @@
-import pdfplumber
 import fitz
-import pytesseract
-from pdf2image import convert_from_path
-from PIL import Image
+from PIL import Image, features
 import numpy as np
 import re
 import string
 from dotenv import load_dotenv
 import os
-from surya.ocr import run_ocr
-from surya.model.detection.model import load_model as load_det_model, load_processor as load_det_processor
-from surya.model.recognition.model import load_model as load_rec_model
-from surya.model.recognition.processor import load_processor as load_rec_processor
 import json
-from google.genai import Client
-from google.genai import types
 import base64
+import multiprocessing
+import threading
+import queue
+from collections import deque
+import tempfile
+import weakref
+from contextlib import nullcontext, contextmanager
+import time
 from io import BytesIO
+from types import SimpleNamespace
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ExtractionCache import ExtractionCache
+from PageRenderCache import PageRenderCache
+from TextNormalizer import TextNormalizer
+from RateLimiter import TokenBucket, retry_with_backoff
+from TextLayerTriage import TextLayerTriage
+from TesseractEngine import TesseractEngines
+from Metrics import metrics
+from ImagePreprocessor import ImagePreprocessor
+from LineLayout import PageLines, LAYOUT_VERSION, layout, surya_lines, tesseract_lines, pymupdf_lines
 
 load_dotenv()
 
-class PDFProcessor:
+WEBP_SUPPORTED = features.check('webp')
+
+class BackendRegistry:
+    # extraction backends are imported and initialised the first time they are used
     def __init__(self):
-        self.doctr_model = None
+        self.loaders = {}
+        self.selectable = []
+        self.loaded = {}
+        self.load_times = {}
+        self.locks = {}
+
+    def register(self, name, loader, selectable=True):
+        self.loaders[name] = loader
+        self.locks[name] = threading.Lock()
+        if selectable:
+            self.selectable.append(name)
+
+    def names(self):
+        return list(self.selectable)
+
+    def is_loaded(self, name):
+        return name in self.loaded
+
+    def get(self, name):
+        if name in self.loaded:
+            return self.loaded[name]
+        if name not in self.loaders:
+            raise ValueError(f"Unknown extraction method: {name}")
+        with self.locks[name]:
+            if name not in self.loaded:
+                start = time.perf_counter()
+                backend = self.loaders[name]()
+                self.load_times[name] = time.perf_counter() - start
+                print(f'backend {name} loaded in {self.load_times[name]:.2f}s')
+                self.loaded[name] = backend
+        return self.loaded[name]
+
+def _load_gemini():
+    from google.genai import Client
+    from google.genai import types
+    http_options = None
+    if os.getenv("GEMINI_BASE_URL"): # e.g. the local gemini_stub.py
+        http_options = types.HttpOptions(base_url=os.getenv("GEMINI_BASE_URL"))
+    return SimpleNamespace(
+        client=Client(api_key=os.getenv("GOOGLE_API_KEY"), http_options=http_options),
+        types=types,
+        requests=TokenBucket(int(os.getenv("GEMINI_RPM", 15))),
+        tokens=TokenBucket(int(os.getenv("GEMINI_TPM", 1000000))),
+    )
+
+def _load_pdfplumber():
+    import pdfplumber
+    return pdfplumber
+
+def _limit_tesseract_threads():
+    # tesseract's OpenMP threads would compete with the page level parallelism (workers, prefetch);
+    # read when the library starts, so it is set before either tesseract backend loads
+    os.environ.setdefault('OMP_THREAD_LIMIT', os.getenv('TESSERACT_THREADS', '1'))
+
+def _load_tesseract():
+    _limit_tesseract_threads()
+    import pytesseract
+    if os.getenv('TESSER_ENGINE'):
+        pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSER_ENGINE')
+    return pytesseract
+
+def _load_tesserocr():
+    # optional in-process engines; without tesserocr every page goes through pytesseract's subprocess
+    if os.getenv('TESSEROCR', 'true').lower() in ('false', '0'):
+        return None
+    _limit_tesseract_threads()
+    try:
+        import tesserocr
+    except ImportError:
+        return None
+    return TesseractEngines(tesserocr, os.getenv('TESSDATA_PREFIX'))
+
+def _load_pymupdf():
+    return fitz
+
+def _load_surya():
+    from surya.ocr import run_ocr
+    from surya.model.detection.model import load_model as load_det_model, load_processor as load_det_processor
+    from surya.model.recognition.model import load_model as load_rec_model
+    from surya.model.recognition.processor import load_processor as load_rec_processor
+    return SimpleNamespace(
+        run_ocr=run_ocr,
+        det_processor=load_det_processor(), det_model=load_det_model(),
+        rec_model=load_rec_model(), rec_processor=load_rec_processor()
+    )
+
+def _load_pdf2image():
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    return SimpleNamespace(convert_from_path=convert_from_path, pdfinfo_from_path=pdfinfo_from_path, tesseract=backends.get("tesseract"))
+
+def _load_doctr():
+    from doctr.io import DocumentFile
+    from doctr.models import ocr_predictor
+    return SimpleNamespace(DocumentFile=DocumentFile, model=ocr_predictor(pretrained=True))
+
+def _load_hybrid():
+    # the text layer is read with PyMuPDF, only the OCR backend for the other pages needs loading
+    ocr = os.getenv('HYBRID_OCR', 'tesseract')
+    backends.get(ocr)
+    return SimpleNamespace(ocr=ocr)
+
+# options each backend's iter_pages takes, hybrid passes the matching ones to its OCR backend
+OCR_OPTIONS = {
+    "surya": ("batch_size", "x"),
+    "tesseract": ("x",),
+    "gemini-2-flash": ("max_in_flight",),
+    "pdf2image/tesseract": ("chunk_size", "thread_count", "use_temp_dir"),
+}
+
+# engines "All Methods" compares; the text layer ones don't need the rendered page
+COMPARE_METHODS = ["pdfplumber", "PyMuPDF", "tesseract", "surya", "gemini-2-flash"]
+TEXT_LAYER_METHODS = ("pdfplumber", "PyMuPDF")
+# what parse_single_page extracts; pdf2image/tesseract and doctr only run on the whole file
+SINGLE_PAGE_METHODS = ("pdfplumber", "PyMuPDF", "tesseract", "surya", "gemini-2-flash", "hybrid")
+
+backends = BackendRegistry()
+backends.register("gemini-2-flash", _load_gemini)
+backends.register("pdfplumber", _load_pdfplumber)
+backends.register("tesseract", _load_tesseract)
+backends.register("PyMuPDF", _load_pymupdf)
+backends.register("surya", _load_surya)
+backends.register("hybrid", _load_hybrid)
+backends.register("tesserocr", _load_tesserocr, selectable=False)
+backends.register("pdf2image/tesseract", _load_pdf2image, selectable=False)
+backends.register("doctr (OCR)", _load_doctr, selectable=False)
+
+_worker_processor = None
+
+def _init_worker(preprocess=False):
+    # every worker process keeps its own processor and opens its own pdf handles
+    global _worker_processor
+    os.environ['OMP_THREAD_LIMIT'] = '1' # one tesseract thread per worker process
+    _worker_processor = PDFProcessor(cache=ExtractionCache(max_mb=0)) # the parent process owns the cache
+    _worker_processor.preprocess = preprocess
+
+def _extract_worker(pdf_path, method, page_nums, x=0):
+    # the chunk's results and the stage spans recorded for it, merged into the parent's metrics
+    return _worker_processor.extract_pages(pdf_path, method, page_nums, x), metrics.take_spans()
+
+class PDFProcessor:
+    def __init__(self, cache=None, render_cache=None, pool=None):
+        self.backends = backends
         self.temp_pdf_path = None
         self.doc = None
+        self.doc_lock = threading.RLock()
+        self.pool = pool
+        self.handle = None
+        self._release_handle = None
+        self.doc_path = None
+        self.doc_hash = None
+        self.cache = cache if cache is not None else ExtractionCache()
+        self.render_cache = render_cache if render_cache is not None else PageRenderCache()
+        self.tesseract_lang = 'fas+ara'
         self.latin_digits = "12345678900987654321"
         self.farsi_digits = "۱۲۳۴۵۶۷۸۹۰٠٩٨٧٦٥٤٣٢١"
         self.repl = str.maketrans(self.farsi_digits, self.latin_digits)
+        self.lefties_normalizer = TextNormalizer.shared(["digits", "lefties"])
+        self.plumber_normalizer = TextNormalizer.shared(["plumber", "digits"])
         self.langs = ["fa", "ar"] # Replace with your languages - optional but recommended
-        self.gemini_client = Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.triage = TextLayerTriage()
+        # OCR input: the 2x RGB render, or with preprocess a binarised/grayscale, deskewed and cropped page at an adaptive scale
+        self.preprocess = os.getenv('OCR_PREPROCESS', 'False').lower() in ('true', '1')
+        self.preprocessor = ImagePreprocessor()
+        self.metrics = metrics
+        # worker processes kept across iter_parallel calls, see open_workers
+        self.worker_pool = None
+        # method -> (threads, executor) of iter_compare, kept until cleanup so their per-thread engines
+        # (tesserocr APIs) are built once, not on every call
+        self.compare_executors = {}
+
+    @property
+    def gemini_client(self):
+        return self.backends.get("gemini-2-flash").client
 
     def load_surya(self):
-        self.surya_det_processor, self.surya_det_model = load_det_processor(), load_det_model()
-        self.surya_rec_model, self.surya_rec_processor = load_rec_model(), load_rec_processor()
-
-    def init_doctr(self):
-        if self.doctr_model is None:
-            from doctr.io import DocumentFile
-            from doctr.models import ocr_predictor
-            self.doctr_model = ocr_predictor(pretrained=True)
+        return self.backends.get("surya")
     
-    def load_document(self, pdf_path):
-        if self.doc:
-            self.doc.close()
-        self.doc = fitz.open(pdf_path)
+    def load_document(self, pdf_path, digest=None):
+        if pdf_path is None:
+            return 0
+        if self.doc is not None and pdf_path == self.doc_path:
+            return len(self.doc)
+        digest = digest or ExtractionCache.hash_file(pdf_path)
+        if self.pool is None:
+            if self.doc:
+                self.doc.close()
+            self.doc = fitz.open(pdf_path)
+        else:
+            # documents are shared between sessions through the pool instead of reopened per rerun
+            self.release_document()
+            self.handle = self.pool.acquire(digest, pdf_path)
+            self._release_handle = weakref.finalize(self, self.pool.release, self.handle)
+            self.doc = self.handle.doc
+            self.doc_lock = self.handle.lock
+        self.doc_hash = digest
+        self.doc_path = pdf_path
         return len(self.doc)
 
+    def lock_for(self, doc):
+        # what guards doc: this processor's lock, the pool handle's when another reader (the prefetcher)
+        # passes a pooled document, nothing for a handle of its own
+        if doc is self.doc:
+            return self.doc_lock
+        lock = self.pool.lock_for(doc) if self.pool is not None else None
+        return lock if lock is not None else nullcontext()
+
+    def release_document(self):
+        if self.handle is not None:
+            self._release_handle()
+            self.handle = None
+            self._release_handle = None
+            self.doc = None
+            self.doc_lock = threading.RLock()
+            self.doc_path = None
+
+    @contextmanager
+    def plumber_pdf(self):
+        if self.handle is not None:
+            with self.handle.plumber_lock:
+                yield self.handle.plumber()
+        else:
+            with self.backends.get("pdfplumber").open(self.temp_pdf_path) as pdf:
+                yield pdf
+
+    def page_text(self, page_num, doc=None):
+        doc = doc or self.doc
+        with self.lock_for(doc):
+            return doc[page_num].get_text()
+
+    def span(self, stage, page_num=None, method=None):
+        # a timed stage of this document, page and method default to the enclosing metrics.page()
+        return self.metrics.span(stage, page_num, method, self.doc_hash)
+
+    def render_entry(self, page_num, zoom=2, doc=None):
+        # (mode, width, height, samples) of the cached render, the raw buffer for engines that take one
+        key = (self.doc_hash, page_num, zoom)
+        entry = self.render_cache.get(key)
+        if entry is None:
+            doc = doc or self.doc
+            with self.span("render", page_num):
+                with self.lock_for(doc):
+                    pix = doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                entry = ("RGB", pix.width, pix.height, pix.samples)
+            self.render_cache.put(key, entry)
+        return entry
+
+    def render_page(self, page_num, zoom=2, doc=None):
+        # page_num is zero based; pass doc when rendering from another thread with its own handle
+        mode, width, height, samples = self.render_entry(page_num, zoom, doc)
+        # shares the cached buffer, PIL copies on any modification
+        with self.span("to_pil", page_num):
+            return Image.frombuffer(mode, (width, height), samples, "raw", mode, 0, 1)
+
+    def viewer_image(self, page_num, zoom_level=100, fmt=None, quality=None):
+        # encoded image for the viewer at the size it is shown (the 2x render scaled by zoom_level),
+        # returns (mime type, bytes); only the encoded bytes are cached for zooms the OCR methods don't share
+        fmt = (fmt or os.getenv('VIEWER_FORMAT', 'webp')).lower()
+        if fmt == 'webp' and not WEBP_SUPPORTED:
+            fmt = 'jpeg'
+        quality = int(quality if quality is not None else os.getenv('VIEWER_QUALITY', 80))
+        zoom = round(2 * zoom_level / 100, 2)
+        key = (self.doc_hash, page_num, zoom, fmt, quality)
+        entry = self.render_cache.get(key)
+        if entry is None:
+            if zoom == 2:
+                image = self.render_page(page_num)
+            else:
+                with self.span("viewer_render", page_num), self.doc_lock:
+                    pix = self.doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                image = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", 0, 1)
+            buffered = BytesIO()
+            with self.span("viewer_encode", page_num):
+                image.save(buffered, format=fmt.upper(), quality=quality)
+            entry = (f"image/{fmt}", image.width, image.height, buffered.getvalue())
+            self.render_cache.put(key, entry)
+        return entry[0], entry[3]
+
+    def cache_params(self, method, x=None):
+        params = {}
+        if method == "tesseract":
+            params = {"matrix": 2, "lang": self.tesseract_lang, "col_center": x or 0, "layout": LAYOUT_VERSION}
+        if method == "pdf2image/tesseract":
+            params = {"lang": "fas"}
+        if method == "surya":
+            params = {"matrix": 2, "langs": self.langs, "col_center": x or 0, "layout": LAYOUT_VERSION}
+        if method == "gemini-2-flash":
+            params = {"matrix": 2, "model": os.getenv("GEMINI_MODEL")}
+        if self.preprocess and method in ("tesseract", "surya", "gemini-2-flash"):
+            params["matrix"] = "adaptive"
+            # tesseract gets the binarised page, the neural engines the grayscale one
+            params["preprocess"] = self.preprocessor.params(binary=method == "tesseract")
+        return params
+
+    def cache_key(self, page_num, method, x=None):
+        return ExtractionCache.make_key(self.doc_hash, page_num, method, self.cache_params(method, x))
+
+    def lines_key(self, page_num, method):
+        # line geometry doesn't depend on the column split or the layout
+        params = {k: v for k, v in self.cache_params(method).items() if k not in ("col_center", "layout")}
+        return ExtractionCache.make_key(self.doc_hash, page_num, method + ":lines", params)
+
+    def ocr_image(self, page_num, doc=None, binary=True):
+        # zero based; the stage timings go to the metrics, and stay on the OCRImage
+        return self._preprocessed(page_num, doc, lambda page: self.preprocessor.process(page, binary))
+
+    def ocr_images(self, page_num, doc=None):
+        # (grayscale, binarised) OCRImages of one render, for comparing tesseract with the other engines
+        gray = None
+        def process(page):
+            nonlocal gray
+            gray, binary = self.preprocessor.process_both(page)
+            return binary
+        binary = self._preprocessed(page_num, doc, process)
+        return gray, binary
+
+    def _preprocessed(self, page_num, doc, process):
+        doc = doc or self.doc
+        with self.lock_for(doc):
+            ocr_image = process(doc[page_num])
+        for stage, seconds in ocr_image.timings.items():
+            self.metrics.observe(f"preprocess_{stage}", seconds, page_num, doc=self.doc_hash)
+        return ocr_image
+
+    def ocr_input(self, page_num, doc=None, binary=False):
+        # (PIL image, OCRImage or None); neural engines get RGB
+        if not self.preprocess:
+            return self.render_page(page_num, doc=doc), None
+        ocr_image = self.ocr_image(page_num, doc, binary)
+        return (ocr_image.image if binary else ocr_image.image.convert("RGB")), ocr_image
+
+    @staticmethod
+    def render_space_lines(lines, ocr_image):
+        # boxes from a preprocessed image back to the 2x render space layout and col_center work in
+        if ocr_image is None:
+            return lines
+        return PageLines(ocr_image.to_render_space(lines.boxes), lines.texts, lines.conf, ocr_image.page_width * 2)
+
+    def page_lines(self, page_num, method, doc=None, compute=True):
+        # PageLines of a zero based page for surya, tesseract or PyMuPDF, cached apart from the text;
+        # with compute=False only a cached copy is returned (or None)
+        key = self.lines_key(page_num, method)
+        raw = self.cache.get(key)
+        if raw is not None:
+            return PageLines.from_json(raw)
+        if not compute:
+            return None
+        if method in ("surya", "tesseract"):
+            lines = self.recognize_lines(method, *self.ocr_input(page_num, doc, binary=(method == "tesseract")))
+        elif method == "PyMuPDF":
+            doc = doc or self.doc
+            with self.lock_for(doc):
+                page = doc[page_num]
+                lines = pymupdf_lines(page.get_text("words"), 2, page.rect.width)
+        else:
+            raise ValueError(f"Line geometry is not available for {method}")
+        self.cache.put(key, lines.to_json())
+        return lines
+
+    def recognize_lines(self, method, img, ocr_image=None):
+        # runs surya or tesseract on an image that is already rendered (or preprocessed), boxes in the 2x render space
+        with self.span("ocr", method=method):
+            lines = self.run_ocr(method, img)
+        return self.render_space_lines(lines, ocr_image)
+
+    def run_ocr(self, method, img):
+        if method == "surya":
+            surya = self.backends.get("surya")
+            img = img if img.mode == "RGB" else img.convert("RGB")
+            predictions = surya.run_ocr([img], [self.langs], surya.det_model, surya.det_processor, surya.rec_model, surya.rec_processor)
+            lines = surya_lines(predictions[0], img.width)
+        elif method == "tesseract":
+            engines = self.backends.get("tesserocr")
+            if engines is not None:
+                lines = engines.page_lines(img, self.tesseract_lang)
+            else:
+                tesseract = self.backends.get("tesseract")
+                lines = tesseract_lines(tesseract.image_to_data(img, lang=self.tesseract_lang, output_type=tesseract.Output.DICT), img.width)
+        else:
+            raise ValueError(f"OCR is not available for {method}")
+        return lines
+
+    def layout_text(self, method, lines, x=0):
+        with self.span("layout", method=method):
+            text = layout(lines, x)
+        return self.justifies_lefties(text) if method == "PyMuPDF" else text
+
+    def relayout(self, page, method, x=0):
+        # re-orders a page (1-based) from its stored lines without running OCR again; None when there are none
+        if self.doc_hash is None:
+            return None
+        lines = self.page_lines(page - 1, method, compute=(method == "PyMuPDF")) # only the text layer is cheap to read again
+        if lines is None:
+            return None
+        text = self.layout_text(method, lines, x)
+        if text and method in ("surya", "tesseract"):
+            self.cache.put(self.cache_key(page - 1, method, x), text)
+        return text
+
+    def cached_extract(self, page_num, method, extract, x=None):
+        # page_num is zero based, extract() is only called on a cache miss
+        key = self.cache_key(page_num, method, x)
+        text = self.cache.get(key)
+        self.metrics.count("extraction_cache", method=method, result="miss" if text is None else "hit")
+        if text is None:
+            with self.metrics.page(page_num, method, self.doc_hash):
+                text = extract()
+            if text:
+                self.cache.put(key, text)
+        return text
+
     def reverse_match(self, match):
         return match.group(0)[::-1]
         
     def justifies_lefties(self, txt):
-        new_txt = txt.translate(self.repl)
-        new_txt = re.sub('[A-Za-z' + string.punctuation + ']+', self.reverse_match, new_txt)
-        new_txt = re.sub(r'\d+', self.reverse_match, new_txt)
-        return new_txt
+        with self.span("normalize"):
+            return self.lefties_normalizer.normalize(txt)
     
     def build_index(self, txt):
         pattern = r'^(?P<number>\d+)\s+(?P<string1>.+?)(:\s+(?P<string2>.+))?$'
@@ -77,40 +473,201 @@ class PDFProcessor:
         return records
 
     def adjust_plumber_text(self, text):
-        tmp = [x.translate(self.repl) for x in ''.join(list(reversed(list(text)))).split("\n")[::-1]]
-        return '\n'.join(tmp)
+        with self.span("normalize"):
+            return self.plumber_normalizer.normalize(text)
 
-    def process_with_pdfplumber(self, pdf_path):
+    def extract_pages(self, pdf_path, method, page_nums, x=0):
         results = []
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                text = page.extract_text()
-                results.append({
-                    "page": page_num + 1,
-                    "text": self.adjust_plumber_text(text) if text else "No text extracted"
-                })
+        if method == "pdfplumber":
+            with self.backends.get("pdfplumber").open(pdf_path) as pdf:
+                for page_num in page_nums:
+                    with self.metrics.page(page_num, method):
+                        text = pdf.pages[page_num].extract_text()
+                        results.append({
+                            "page": page_num + 1,
+                            "text": self.adjust_plumber_text(text) if text else "No text extracted"
+                        })
+            return results
+
+        doc = fitz.open(pdf_path)
+        try:
+            for page_num in page_nums:
+                with self.metrics.page(page_num, method):
+                    page = doc[page_num]
+                    if method == "PyMuPDF":
+                        text = self.justifies_lefties(page.get_text())
+                    elif method == "tesseract":
+                        # workers have no cache, the parent stores the lines they send back
+                        lines = self.page_lines(page_num, method, doc)
+                        results.append({
+                            "page": page_num + 1,
+                            "text": self.layout_text(method, lines, x) or "No text extracted",
+                            "lines": lines.to_json()
+                        })
+                        continue
+                    else:
+                        raise ValueError(f"Parallel extraction is not supported for {method}")
+                    results.append({
+                        "page": page_num + 1,
+                        "text": text if text else "No text extracted"
+                    })
+        finally:
+            doc.close()
+        return results
+
+    def page_record(self, page_num, text):
+        return {
+            "page": page_num + 1,
+            "text": text if text else "No text extracted"
+        }
+
+    def iter_pages(self, method, page_range=None, workers=1, **options):
+        # yields {"page", "text"} records one page at a time; page_range holds 1-based page numbers
+        page_nums = [page - 1 for page in page_range] if page_range is not None else list(range(len(self.doc)))
+        if method == "surya":
+            yield from self.iter_surya_batched(self.doc_path, page_nums, options.get("batch_size"), options.get("x", 480))
+        elif method == "gemini-2-flash":
+            for page_num, text in self.iter_gemini_pages(page_nums, options.get("max_in_flight")):
+                if text is None:
+                    # failed after its retries, left without text for the next Parse All
+                    continue
+                yield self.page_record(page_num, text)
+        elif method == "pdf2image/tesseract":
+            yield from self.iter_pdf2image_tesseract(self.doc_path, page_nums, **options)
+        elif method == "hybrid":
+            yield from self.iter_hybrid(page_nums, workers, **options)
+        elif workers > 1:
+            yield from self.iter_parallel(self.doc_path, method, page_nums, workers, options.get("x", 0))
+        elif method == "pdfplumber":
+            with self.backends.get("pdfplumber").open(self.doc_path) as pdf:
+                for page_num in page_nums:
+                    page = pdf.pages[page_num]
+                    yield self.page_record(page_num, self.cached_extract(page_num, method, lambda: self.adjust_plumber_text(page.extract_text() or '')))
+        elif method == "PyMuPDF":
+            for page_num in page_nums:
+                yield self.page_record(page_num, self.cached_extract(page_num, method, lambda: self.justifies_lefties(self.page_text(page_num))))
+        elif method == "tesseract":
+            x = options.get("x", 0)
+            for page_num in page_nums:
+                yield self.page_record(page_num, self.cached_extract(page_num, method, lambda: self.tesseract_page(page_num, x=x), x))
+        else:
+            raise ValueError(f"Streaming extraction is not supported for {method}")
+
+    def page_route(self, page_num, doc=None, text=None):
+        # zero based; (method, reason): PyMuPDF when the text layer is good enough, the hybrid OCR backend otherwise
+        doc = doc or self.doc
+        with self.lock_for(doc):
+            needs_ocr, reason = self.triage.route(self.triage.score(doc[page_num], text))
+        return (self.backends.get("hybrid").ocr if needs_ocr else "PyMuPDF"), reason
+
+    def iter_hybrid(self, page_nums, workers=1, **options):
+        # text layer pages are yielded first, then the OCR backend's pages as it finishes them;
+        # every record carries its "route" (the method used) and the "reason"
+        ocr = self.backends.get("hybrid").ocr
+        ocr_pages = {}
+        for page_num in page_nums:
+            text = self.page_text(page_num)
+            method, reason = self.page_route(page_num, text=text)
+            if method != "PyMuPDF":
+                ocr_pages[page_num] = reason
+                continue
+            record = self.page_record(page_num, self.cached_extract(page_num, method, lambda: self.justifies_lefties(text)))
+            record.update(route=method, reason=reason)
+            yield record
+        # how the pages were routed, next to the other counters of the metrics panel
+        self.metrics.count("hybrid_pages", len(page_nums) - len(ocr_pages), route="PyMuPDF")
+        self.metrics.count("hybrid_pages", len(ocr_pages), route=ocr)
+        if ocr_pages:
+            ocr_options = {k: v for k, v in options.items() if k in OCR_OPTIONS.get(ocr, ())}
+            for record in self.iter_pages(ocr, [page_num + 1 for page_num in ocr_pages], workers, **ocr_options):
+                record.update(route=ocr, reason=ocr_pages[record["page"] - 1])
+                yield record
+
+    def iter_parallel(self, pdf_path, method, page_nums, workers=None, x=0):
+        workers = workers or int(os.getenv('EXTRACT_WORKERS', os.cpu_count() or 1))
+        cached = {}
+        missing = []
+        for page_num in page_nums:
+            text = self.cache.get(self.cache_key(page_num, method, x))
+            if text is None and method == "tesseract":
+                text = self.relayout(page_num + 1, method, x)
+            if text is None:
+                missing.append(page_num)
+            else:
+                cached[page_num] = text
+
+        if not missing:
+            for page_num in page_nums:
+                yield self.page_record(page_num, cached[page_num])
+            return
+
+        # several small chunks per worker so slow (e.g. scanned) pages don't leave cores idle
+        chunk = max(1, -(-len(missing) // (workers * 4)))
+        chunks = [missing[i:i + chunk] for i in range(0, len(missing), chunk)]
+        executor = self.worker_pool or self.process_pool(min(workers, len(chunks)))
+        futures = []
+        try:
+            futures = [executor.submit(_extract_worker, pdf_path, method, c, x) for c in chunks]
+            chunk_of = {page_num: i for i, c in enumerate(chunks) for page_num in c}
+            done = {}
+            # pages are yielded in order, waiting on the chunk that holds the next one
+            for page_num in page_nums:
+                if page_num in cached:
+                    yield self.page_record(page_num, cached.pop(page_num))
+                    continue
+                if page_num not in done:
+                    results, spans = futures[chunk_of[page_num]].result()
+                    self.metrics.add_spans(spans, self.doc_hash)
+                    for r in results:
+                        if "lines" in r:
+                            self.cache.put(self.lines_key(r["page"] - 1, method), r.pop("lines"))
+                        if r["text"] != "No text extracted":
+                            self.cache.put(self.cache_key(r["page"] - 1, method, x), r["text"])
+                        done[r["page"] - 1] = r
+                yield done.pop(page_num)
+        finally:
+            if executor is self.worker_pool:
+                # the pool outlives this call, only its chunks are dropped
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+            else:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def open_workers(self, workers):
+        # one process pool for every iter_parallel call until cleanup, e.g. the chunks of a background job,
+        # so the workers start and load their backends once
+        if self.worker_pool is None and workers > 1:
+            self.worker_pool = self.process_pool(workers)
+
+    def process_pool(self, workers):
+        # spawned, not forked: a thread of the app (streamlit, prefetch, jobs, metrics) may hold a lock
+        # a forked child would inherit held forever
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker, initargs=(self.preprocess,))
+
+    def process_parallel(self, pdf_path, method, workers=None):
+        self.load_document(pdf_path)
+        return list(self.iter_parallel(pdf_path, method, range(len(self.doc)), workers))
+
+    # the process_with_* helpers parse pdf_path, loading it first when another document is open
+    def process_with_pdfplumber(self, pdf_path, workers=1):
+        self.load_document(pdf_path)
+        results = list(self.iter_pages("pdfplumber", workers=workers))
         print('pages: ', len(results))
         return results
     
-    def process_with_pymupdf(self, pdf_path):
-        results = []
-        for page_num in range(len(self.doc)):
-            page = self.doc[page_num]
-            text = page.get_text()
-            results.append({
-                "page": page_num + 1,
-                "text": self.justifies_lefties(text) if text else "No text extracted"
-            })
-        return results
+    def process_with_pymupdf(self, pdf_path, workers=1):
+        self.load_document(pdf_path)
+        return list(self.iter_pages("PyMuPDF", workers=workers))
     
     def process_with_doctr(self, pdf_path):
         try:
-            self.init_doctr()
-            from doctr.io import DocumentFile
+            doctr = self.backends.get("doctr (OCR)")
             
             results = []
-            document = DocumentFile.from_pdf(pdf_path)
-            result = self.doctr_model(document)
+            document = doctr.DocumentFile.from_pdf(pdf_path)
+            result = doctr.model(document)
             for page_num, page in enumerate(result.pages):
                 text = page.export()
                 results.append({
@@ -121,133 +678,410 @@ class PDFProcessor:
         except ImportError:
             return [{"page": 1, "text": "doctr is not installed. Install with: pip install python-doctr"}]
 
-    def process_with_pdf2image_tesseract(self, pdf_path):
-        results = []
-        pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSER_ENGINE')
-        pdf = convert_from_path(pdf_path, poppler_path=os.getenv('PDF2IMAGE_ENGINE'))
-        for page_num in range(len(pdf)):
-            text = pytesseract.image_to_string(pdf[page_num], lang='fas')
-            results.append({
-                "page": page_num + 1,
-                "text": text if text else "No text extracted"
-            })
-        return results
-    
-    def process_with_tesseract(self, pdf_path):
+    def process_with_pdf2image_tesseract(self, pdf_path, chunk_size=None, thread_count=None, use_temp_dir=None):
+        return list(self.iter_pdf2image_tesseract(pdf_path, None, chunk_size, thread_count, use_temp_dir))
+
+    def iter_pdf2image_tesseract(self, pdf_path, page_nums=None, chunk_size=None, thread_count=None, use_temp_dir=None):
+        # converts and OCRs chunk_size pages at a time so peak memory depends on the window, not the book
+        pdf2image = self.backends.get("pdf2image/tesseract")
+        engines = self.backends.get("tesserocr")
+        poppler_path = os.getenv('PDF2IMAGE_ENGINE')
+        chunk_size = chunk_size or int(os.getenv('PDF2IMAGE_CHUNK', 8))
+        thread_count = thread_count or int(os.getenv('PDF2IMAGE_THREADS', 2))
+        if use_temp_dir is None:
+            use_temp_dir = os.getenv('PDF2IMAGE_TEMP_DIR', 'False').lower() in ('true', '1')
+        if page_nums is None:
+            page_nums = range(pdf2image.pdfinfo_from_path(pdf_path, poppler_path=poppler_path)["Pages"])
+        page_nums = list(page_nums)
+
+        for i in range(0, len(page_nums), chunk_size):
+            window = page_nums[i:i + chunk_size]
+            texts = {page_num: self.cache.get(self.cache_key(page_num, "pdf2image/tesseract")) for page_num in window}
+            missing = [page_num for page_num in window if texts[page_num] is None]
+            if missing:
+                first, last = missing[0] + 1, missing[-1] + 1
+                # with a temp dir poppler writes the pages to disk and PIL reads them lazily
+                with (tempfile.TemporaryDirectory() if use_temp_dir else nullcontext()) as output_folder:
+                    with self.span("convert", method="pdf2image/tesseract"):
+                        images = pdf2image.convert_from_path(pdf_path, first_page=first, last_page=last, thread_count=thread_count,
+                                                             output_folder=output_folder, poppler_path=poppler_path)
+                    for page_num in missing:
+                        img = images[page_num + 1 - first]
+                        with self.metrics.page(page_num, "pdf2image/tesseract", self.doc_hash), self.span("ocr"):
+                            if engines is not None:
+                                texts[page_num] = engines.text(img, 'fas')
+                            else:
+                                texts[page_num] = pdf2image.tesseract.image_to_string(img, lang='fas')
+                        if texts[page_num]:
+                            self.cache.put(self.cache_key(page_num, "pdf2image/tesseract"), texts[page_num])
+                    for img in images:
+                        img.close()
+                    del images
+            for page_num in window:
+                yield self.page_record(page_num, texts[page_num])
+
+    def process_with_tesseract(self, pdf_path, workers=1):
         try:
-            results = []
-            pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSER_ENGINE')
-
-            for page_num in range(len(self.doc)):
-                page = self.doc[page_num]
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                
-                # Convert PyMuPDF pixmap to PIL Image
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                
-                # Perform OCR
-                text = pytesseract.image_to_string(img, lang='fas+ara')
-                
-                results.append({
-                    "page": page_num + 1,
-                    "text": text if text else "No text extracted"
-                })
-            return results
+            self.load_document(pdf_path)
+            return list(self.iter_pages("tesseract", workers=workers))
         except ImportError:
             return [{"page": 1, "text": "Tesseract is not installed. Install with: pip install pytesseract"}]
         except Exception as e:
             return [{"page": 1, "text": f"Error processing with Tesseract: {str(e)}"}]
 
+    def tesseract_page(self, page_num, doc=None, x=0):
+        # image_to_data instead of image_to_string, the line boxes are kept for re-layout
+        return self.layout_text("tesseract", self.page_lines(page_num, "tesseract", doc), x)
+
+    def surya_page(self, page_num, x, doc=None):
+        return self.layout_text("surya", self.page_lines(page_num, "surya", doc), x)
+
     def parse_with_surya(self, pdf_path):
         all_pages = []
         for page_num in range(len(self.doc)):
-            page = self.doc[page_num]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            
-            # Convert PyMuPDF pixmap to PIL Image
-            all_lines = ''
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            predictions = run_ocr([img], [self.langs], self.surya_det_model, self.surya_det_processor, self.surya_rec_model, self.surya_rec_processor)
-            for line in json.loads(predictions[0].json())['text_lines']:
-                if line['bbox'][0] > 480: #right col
-                    all_lines += line['text'] + "\n"
-            for line in json.loads(predictions[0].json())['text_lines']:
-                if line['bbox'][0] <= 480: #left col
-                    all_lines += line['text'] + "\n"
+            all_lines = self.cached_extract(page_num, "surya", lambda: self.surya_page(page_num, 480), 480)
             all_pages.append({
                 'page': page_num + 1,
                 'text': all_lines if all_lines != '' else "No text extracted"
             })
         return all_pages
 
-    def gemini_single_page(self, page):
-        p = self.doc[page]
-        pix = p.get_pixmap(matrix=fitz.Matrix(2, 2))
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    def parse_with_surya_batched(self, pdf_path, batch_size=None, x=480):
+        return list(self.iter_surya_batched(pdf_path, range(len(self.doc)), batch_size, x))
+
+    def iter_surya_batched(self, pdf_path, page_nums, batch_size=None, x=480):
+        surya = self.backends.get("surya")
+        batch_size = batch_size or int(os.getenv('SURYA_BATCH_SIZE', 8))
+        page_nums = list(page_nums)
+
+        texts = {}
+        todo = []
+        for page_num in page_nums:
+            text = self.cache.get(self.cache_key(page_num, "surya", x))
+            if text is None:
+                # OCR'd before with another column split
+                text = self.relayout(page_num + 1, "surya", x)
+            if text is None:
+                todo.append(page_num)
+            else:
+                texts[page_num] = text
+
+        # pages are rendered ahead by a producer thread (with its own fitz handle) while surya runs
+        rendered = queue.Queue(maxsize=batch_size * 2)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    rendered.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            try:
+                with fitz.open(pdf_path) as doc:
+                    for page_num in todo:
+                        if stop.is_set():
+                            return
+                        put((page_num, *self.ocr_input(page_num, doc)))
+            except Exception as e:
+                put(e)
+            put(None)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        next_page = 0
+        try:
+            finished = not todo
+            while not finished:
+                batch = []
+                while len(batch) < batch_size:
+                    item = rendered.get()
+                    if isinstance(item, Exception):
+                        raise item
+                    if item is None:
+                        finished = True
+                        break
+                    batch.append(item)
+                if batch:
+                    start = time.perf_counter()
+                    predictions = surya.run_ocr([img for _, img, _ in batch], [self.langs] * len(batch), surya.det_model, surya.det_processor, surya.rec_model, surya.rec_processor)
+                    # the batch's inference time is split evenly over its pages
+                    share = (time.perf_counter() - start) / len(batch)
+                    for (page_num, img, ocr_image), prediction in zip(batch, predictions):
+                        self.metrics.observe("ocr", share, page_num, "surya", self.doc_hash)
+                        lines = self.render_space_lines(surya_lines(prediction, img.width), ocr_image)
+                        self.cache.put(self.lines_key(page_num, "surya"), lines.to_json())
+                        text = self.layout_text("surya", lines, x)
+                        if text:
+                            self.cache.put(self.cache_key(page_num, "surya", x), text)
+                        texts[page_num] = text
+                # hand out everything that is ready, in page order
+                while next_page < len(page_nums) and page_nums[next_page] in texts:
+                    yield self.page_record(page_nums[next_page], texts.pop(page_nums[next_page]))
+                    next_page += 1
+            while next_page < len(page_nums):
+                yield self.page_record(page_nums[next_page], texts.pop(page_nums[next_page]))
+                next_page += 1
+        finally:
+            stop.set()
+            producer.join()
+
+    def gemini_page_image(self, page, doc=None):
+        # preprocessed pages go up as cropped grayscale, a fraction of the RGB render
+        img = self.ocr_image(page, doc, binary=False).image if self.preprocess else self.render_page(page, doc=doc)
+        with self.span("encode", page):
+            return self.encode_jpeg(img)
+
+    @staticmethod
+    def encode_jpeg(img):
         buffered = BytesIO()
         img.save(buffered, format="JPEG")
         img_bytes = buffered.getvalue()
     
         # Encode as base64
-        encoded_image = base64.b64encode(img_bytes).decode('utf-8')
+        return base64.b64encode(img_bytes).decode('utf-8')
+
+    def gemini_request(self, encoded_image, page_num=None):
+        # page_num labels the request's spans when it runs on a pool thread
+        if page_num is None:
+            return self._gemini_request(encoded_image)
+        with self.metrics.page(page_num, "gemini-2-flash", self.doc_hash):
+            return self._gemini_request(encoded_image)
+
+    def _gemini_request(self, encoded_image):
+        gemini = self.backends.get("gemini-2-flash")
 
         # Convert PDF content to a format suitable for Gemini (bytes)
         contents = [
-            types.Part.from_bytes(
+            gemini.types.Part.from_bytes(
                 mime_type="image/jpeg",
                 data=encoded_image
             ),
             "Extract all the text from this Image. Retain spaces between verses of poems with tab if needed. Just give the Image's content. No extra explanation is needed."
         ]
-        response = self.gemini_client.models.generate_content(
-            model=os.getenv("GEMINI_MODEL"),
-            contents=contents
-        )
+        estimate = int(os.getenv("GEMINI_TOKENS_PER_PAGE", 1500))
 
+        def request():
+            with self.span("rate_limit"):
+                gemini.requests.acquire()
+                gemini.tokens.acquire(estimate)
+            with self.span("network"):
+                try:
+                    response = gemini.client.models.generate_content(
+                        model=os.getenv("GEMINI_MODEL"),
+                        contents=contents
+                    )
+                except Exception as e:
+                    # every failed attempt, retried or not
+                    self.metrics.count("backend_request_errors", method="gemini-2-flash", error=type(e).__name__)
+                    raise
+            used = getattr(response.usage_metadata, 'total_token_count', None)
+            if used:
+                gemini.tokens.consume(used - estimate)
+            return response
+
+        response = retry_with_backoff(request, max_retries=int(os.getenv("GEMINI_MAX_RETRIES", 5)))
         return response.text
 
-    def parse_single_page(self, page, method, x=0):
+    def gemini_single_page(self, page, doc=None):
+        return self.gemini_request(self.gemini_page_image(page, doc))
+
+    def iter_gemini_pages(self, page_nums, max_in_flight=None):
+        # yields (page_num, text) as requests complete, text None for a page whose request failed;
+        # pages are rendered here since self.doc is not thread safe
+        max_in_flight = max_in_flight or int(os.getenv("GEMINI_IN_FLIGHT", 4))
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        pending = {}
+        try:
+            for page_num in page_nums:
+                key = self.cache_key(page_num, "gemini-2-flash")
+                text = self.cache.get(key)
+                if text is not None:
+                    yield page_num, text
+                    continue
+                while len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._gemini_result(pending.pop(future), future)
+                pending[executor.submit(self.gemini_request, self.gemini_page_image(page_num), page_num)] = page_num
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._gemini_result(pending.pop(future), future)
+        finally:
+            # stopped early: drop whatever has not started yet, the requests already sent are still cached
+            for future, page_num in pending.items():
+                if not future.cancel():
+                    # the key now, the processor may have moved to another document when it completes
+                    key = self.cache_key(page_num, "gemini-2-flash")
+                    future.add_done_callback(lambda future, page_num=page_num, key=key: self._gemini_result(page_num, future, key))
+            executor.shutdown(wait=False)
+
+    def _gemini_result(self, page_num, future, key=None):
+        try:
+            text = future.result()
+        except Exception as e:
+            print(f'gemini-2-flash failed on page {page_num + 1}: {e}')
+            return page_num, None
+        if text:
+            self.cache.put(key or self.cache_key(page_num, "gemini-2-flash"), text)
+        return page_num, text
+
+    def compare_text(self, page_num, method, x=0):
+        # cached text of one compared engine, None when it has to run
+        text = self.cache.get(self.cache_key(page_num, method, x))
+        if text is None and method in ("surya", "tesseract"):
+            text = self.relayout(page_num + 1, method, x)
+        return text
+
+    def compare_engine(self, page_num, method, img, ocr_image, x=0):
+        # one engine on the page image shared by all of them; {"text", "seconds"} or {"error"}
+        start = time.perf_counter()
+        try:
+            with self.metrics.page(page_num, method, self.doc_hash):
+                if method == "PyMuPDF":
+                    text = self.justifies_lefties(self.page_text(page_num))
+                elif method == "pdfplumber":
+                    with self.plumber_pdf() as pdf:
+                        text = self.adjust_plumber_text(pdf.pages[page_num].extract_text() or '')
+                elif method == "gemini-2-flash":
+                    with self.span("encode"):
+                        encoded = self.encode_jpeg(img)
+                    text = self.gemini_request(encoded)
+                else:
+                    lines = self.recognize_lines(method, img, ocr_image)
+                    self.cache.put(self.lines_key(page_num, method), lines.to_json())
+                    text = self.layout_text(method, lines, x)
+        except Exception as e:
+            print(f'{method} failed on page {page_num + 1}: {e}')
+            return {"text": None, "seconds": time.perf_counter() - start, "error": str(e)}
+        if text:
+            self.cache.put(self.cache_key(page_num, method, x), text)
+        return {"text": text, "seconds": time.perf_counter() - start}
+
+    def iter_compare(self, page_nums, methods, x=0, pages_ahead=None, max_in_flight=None):
+        # "All Methods": every page is rendered (and preprocessed) once and the same image goes to all OCR engines,
+        # which run next to each other and next to the text layer engines, each engine on its own thread(s).
+        # yields one record per page in order: {"page", "render", "methods": {method: {"text", "seconds", ...}}}
+        methods = [method for method in COMPARE_METHODS if method in methods]
+        pages_ahead = pages_ahead or int(os.getenv('COMPARE_PAGES_AHEAD', 4))
+        max_in_flight = max_in_flight or int(os.getenv("GEMINI_IN_FLIGHT", 4))
+        executors = {method: self.compare_executor(method, max_in_flight if method == "gemini-2-flash" else 1) for method in methods}
+        in_flight = deque()
+
+        def finish(page_num, render, results):
+            record = {"page": page_num + 1, "render": render, "methods": {}}
+            for method in methods:
+                result = results[method]
+                record["methods"][method] = result.result() if isinstance(result, Future) else result
+            return record
+
+        try:
+            for page_num in page_nums:
+                while len(in_flight) >= pages_ahead:
+                    yield finish(*in_flight.popleft())
+                results = {}
+                for method in methods:
+                    text = self.compare_text(page_num, method, x)
+                    if text is not None:
+                        results[method] = {"text": text, "seconds": 0.0, "cached": True}
+                render = 0.0
+                img = ocr_image = binary_image = None
+                if any(method not in results and method not in TEXT_LAYER_METHODS for method in methods):
+                    start = time.perf_counter()
+                    if self.preprocess:
+                        # grayscale for the neural engines, tesseract gets the binarised image page_lines gives it
+                        # (same cache key), both from one render
+                        ocr_image, binary_image = self.ocr_images(page_num)
+                        img = ocr_image.image
+                    else:
+                        img = self.render_page(page_num)
+                    render = time.perf_counter() - start
+                for method in methods:
+                    if method not in results:
+                        if method == "tesseract" and binary_image is not None:
+                            results[method] = executors[method].submit(self.compare_engine, page_num, method, binary_image.image, binary_image, x)
+                        else:
+                            results[method] = executors[method].submit(self.compare_engine, page_num, method, img, ocr_image, x)
+                in_flight.append((page_num, render, results))
+            while in_flight:
+                yield finish(*in_flight.popleft())
+        finally:
+            # stopped early: pages not started yet are dropped, the executors stay for the next call
+            for _, _, results in in_flight:
+                for result in results.values():
+                    if isinstance(result, Future):
+                        result.cancel()
+
+    def compare_executor(self, method, threads):
+        # a new one only when the thread count changed, e.g. "Requests in flight" for gemini
+        current = self.compare_executors.get(method)
+        if current is not None and current[0] == threads:
+            return current[1]
+        if current is not None:
+            current[1].shutdown(wait=False)
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f'compare-{method}')
+        self.compare_executors[method] = (threads, executor)
+        return executor
+
+    def cached_page_text(self, page, method, x=0):
+        # text of an already extracted page, without extracting it
+        if self.doc_hash is None:
+            return None
+        if method == "hybrid":
+            method, _ = self.page_route(page - 1)
+        text = self.cache.get(self.cache_key(page - 1, method, x))
+        if text is None and method in ("surya", "tesseract"):
+            text = self.relayout(page, method, x)
+        return text
+
+    def parse_single_page(self, page, method, x=0, doc=None):
+        # doc: a separate fitz handle for callers on other threads
         print('x: ', x)
+        doc = doc or self.doc
         page = page - 1
         if method == "pdfplumber":
-            with pdfplumber.open(self.temp_pdf_path) as pdf:
-                return self.adjust_plumber_text(pdf.pages[page].extract_text())
+            def extract():
+                with self.plumber_pdf() as pdf:
+                    return self.adjust_plumber_text(pdf.pages[page].extract_text())
+            return self.cached_extract(page, method, extract)
 
         elif method == "PyMuPDF":
-            p = self.doc[page]
-            return self.justifies_lefties(p.get_text())
+            return self.cached_extract(page, method, lambda: self.justifies_lefties(self.page_text(page, doc)))
 
         elif method == "tesseract":
-            pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSER_ENGINE')
-            p = self.doc[page]
-            pix = p.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            return pytesseract.image_to_string(img, lang='fas+ara')
+            return self.cached_extract(page, method, lambda: self.tesseract_page(page, doc, x), x)
         
         elif method =="surya":
-            p = self.doc[page]
-            pix = p.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            predictions = run_ocr([img], [self.langs], self.surya_det_model, self.surya_det_processor, self.surya_rec_model, self.surya_rec_processor)
-            all_lines = ''
-            #with open('test.json', 'w', encoding='utf-8') as out:
-                #out.write(predictions[0].json())
-            for line in json.loads(predictions[0].json())['text_lines']:
-                if line['bbox'][0] > x: #480: #right col
-                    all_lines += line['text'] + "\n"
-            for line in json.loads(predictions[0].json())['text_lines']:
-                if line['bbox'][0] < x: #480: #left col
-                    all_lines += line['text'] + "\n"
-            return all_lines
+            return self.cached_extract(page, method, lambda: self.surya_page(page, x, doc), x)
 
         elif method=="gemini-2-flash": #"geminiflash2":
-            return self.gemini_single_page(page)
+            return self.cached_extract(page, method, lambda: self.gemini_single_page(page, doc))
+
+        elif method == "hybrid":
+            return self.parse_hybrid_page(page + 1, x, doc)[0]
+
+    def parse_hybrid_page(self, page, x=0, doc=None):
+        # (text, route, reason) of a 1-based page, routed once
+        routed, reason = self.page_route(page - 1, doc)
+        return self.parse_single_page(page, routed, x, doc), routed, reason
     
-    def cleanup(self):
-        if self.doc:
+    def cleanup(self, remove_file=True):
+        # spooled uploads are shared with other sessions, the app passes remove_file=False for them
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown(wait=False, cancel_futures=True)
+            self.worker_pool = None
+        for _, executor in self.compare_executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.compare_executors = {}
+        if self.handle is not None:
+            self.release_document()
+        elif self.doc:
             self.doc.close()
             self.doc = None
-        if self.temp_pdf_path and os.path.exists(self.temp_pdf_path):
+        if remove_file and self.temp_pdf_path and os.path.exists(self.temp_pdf_path):
             try:
                 os.remove(self.temp_pdf_path)
             except PermissionError:
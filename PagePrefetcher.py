@@ -0,0 +1,99 @@
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+
+# local and cheap enough to run on pages that may never be opened; the others (surya, gemini, hybrid
+# routing to them) only with ocr=True, otherwise their pages are only rendered
+LOCAL_METHODS = ("pdfplumber", "PyMuPDF", "tesseract")
+
+
+class PagePrefetcher:
+    # renders and extracts the pages around the current one on a background thread,
+    # results land in the processor's render and extraction caches
+    def __init__(self, processor, pages=None, ocr=None):
+        self.processor = processor
+        self.pages = int(pages if pages is not None else os.getenv('PREFETCH_PAGES', 2))
+        self.ocr = ocr if ocr is not None else os.getenv('PREFETCH_OCR', 'False').lower() in ('true', '1')
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.futures = []
+        self.scheduled = None
+        # the document pool's handle, held until the document changes or the prefetcher stops (the processor
+        # takes the handle's lock around fitz calls, fitz is not thread safe); its own fitz handle without a pool
+        self.handle = None
+        self._release_handle = None
+        self.doc = None
+        self.doc_path = None
+
+    def schedule(self, page, method, x=0, pages=None):
+        pages = self.pages if pages is None else pages
+        doc_path = self.processor.doc_path
+        request = (doc_path, page, method, x, pages, self.ocr)
+        with self.lock:
+            if request == self.scheduled:
+                return
+            self.cancel()
+            self.scheduled = request
+            if not doc_path or pages <= 0:
+                return
+            page_count = len(self.processor.doc)
+            order = []
+            for distance in range(1, pages + 1):
+                order += [page + distance, page - distance]
+            generation = self.generation
+            self.futures = [self.executor.submit(self._prefetch, generation, doc_path, p, method, x)
+                            for p in order if 1 <= p <= page_count]
+
+    def cancel(self):
+        # drops queued pages, a page already being extracted finishes and is cached
+        self.generation += 1
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+        self.scheduled = None
+
+    def _document(self, doc_path):
+        if self.doc_path != doc_path:
+            self._release()
+            pool = self.processor.pool
+            if pool is not None:
+                self.handle = pool.acquire(self.processor.doc_hash, doc_path)
+                # a prefetcher dropped with its session gives the handle back as well
+                self._release_handle = weakref.finalize(self, pool.release, self.handle)
+                self.doc = self.handle.doc
+            else:
+                self.doc = fitz.open(doc_path)
+            self.doc_path = doc_path
+        return self.doc
+
+    def _release(self):
+        if self.handle is not None:
+            self._release_handle()
+            self.handle = None
+            self._release_handle = None
+        elif self.doc:
+            self.doc.close()
+        self.doc = None
+        self.doc_path = None
+
+    def _prefetch(self, generation, doc_path, page, method, x):
+        if generation != self.generation or doc_path != self.processor.doc_path:
+            return
+        try:
+            doc = self._document(doc_path)
+            self.processor.render_page(page - 1, doc=doc)
+            if method in LOCAL_METHODS or self.ocr:
+                self.processor.parse_single_page(page, method, x, doc=doc)
+        except Exception as e:
+            print(f'prefetch of page {page} failed: {e}')
+
+    def shutdown(self):
+        with self.lock:
+            self.cancel()
+        # the handle goes back to the pool once the page in progress is done
+        self.executor.submit(self._release)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,48 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class PageRenderCache:
+    # raw page bitmaps keyed by (document hash, page, zoom) and encoded viewer images keyed by
+    # (document hash, page, zoom, format, quality), evicted least recently used past max_mb
+    def __init__(self, max_mb=None):
+        self.max_bytes = int(max_mb if max_mb is not None else os.getenv('RENDER_CACHE_MB', 256)) * 1024 * 1024
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        # entry is (mode, width, height, samples), or (mime type, width, height, encoded bytes) for the viewer
+        size = len(entry[3])
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[3])
+            self.entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped[3])
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size, "entries": len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
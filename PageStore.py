@@ -0,0 +1,214 @@
+from array import array
+from collections.abc import MutableMapping
+
+FLAGS = ("isData", "toReview")
+UNSET = -1
+NO_HUMAN_PAGE = -2 ** 31
+
+
+class TextRecord:
+    __slots__ = ("text", "refs")
+
+    def __init__(self, text):
+        self.text = text
+        self.refs = 0
+
+
+class PageView(MutableMapping):
+    # dict-like view of one page, reads and writes go straight to the store
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.store.get_field(self.index, key)
+
+    def __setitem__(self, key, value):
+        self.store.set_field(self.index, key, value)
+
+    def __delitem__(self, key):
+        self.store.del_field(self.index, key)
+
+    def __iter__(self):
+        return iter(self.store.fields(self.index))
+
+    def __len__(self):
+        return len(self.store.fields(self.index))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class PageStore:
+    # Per-page flags live in arrays, texts (one column per extraction method plus "edited_text")
+    # hold shared TextRecords, so identical texts are stored once, and anything else goes to a sparse extras dict.
+    # Indexing returns a PageView, so code written against the old list of dicts keeps working.
+    def __init__(self, total_pages=0, is_data=True):
+        self.total_pages = total_pages
+        self.flags = {name: array('b', [UNSET]) * total_pages for name in FLAGS}
+        if is_data is not None:
+            self.flags["isData"] = array('b', [int(is_data)]) * total_pages
+        self.data_types = []
+        self.data_type = array('b', [UNSET]) * total_pages
+        self.human_page = array('i', [NO_HUMAN_PAGE]) * total_pages
+        self.texts = {}
+        self.records = {}
+        self.extras = {}
+
+    def __len__(self):
+        return self.total_pages
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.total_pages
+        if not 0 <= index < self.total_pages:
+            raise IndexError(index)
+        return PageView(self, index)
+
+    def __setitem__(self, index, page):
+        # replaces a whole page with the contents of a dict
+        for key in list(self.fields(index)):
+            if key != "page":
+                self.del_field(index, key)
+        for key, value in page.items():
+            if key != "page":
+                self.set_field(index, key, value)
+
+    def __iter__(self):
+        for index in range(self.total_pages):
+            yield PageView(self, index)
+
+    def get(self, page, method):
+        # text of a 1-based page for a method (or "edited_text"), None when missing
+        column = self.texts.get(method)
+        if column is None or not 0 < page <= self.total_pages:
+            return None
+        record = column[page - 1]
+        return record.text if record is not None else None
+
+    def _intern(self, text):
+        record = self.records.get(text)
+        if record is None:
+            record = self.records[text] = TextRecord(text)
+        record.refs += 1
+        return record
+
+    def _release(self, record):
+        record.refs -= 1
+        if record.refs == 0:
+            del self.records[record.text]
+
+    def get_field(self, index, key):
+        if key == "page":
+            return index + 1
+        if key in self.flags:
+            value = self.flags[key][index]
+            if value != UNSET:
+                return bool(value)
+        elif key == "dataType":
+            value = self.data_type[index]
+            if value != UNSET:
+                return self.data_types[value]
+        elif key == "human_page":
+            value = self.human_page[index]
+            if value != NO_HUMAN_PAGE:
+                return value
+        elif key in self.texts:
+            record = self.texts[key][index]
+            if record is not None:
+                return record.text
+        extras = self.extras.get(index)
+        if extras is not None and key in extras:
+            return extras[key]
+        raise KeyError(key)
+
+    def set_field(self, index, key, value):
+        if key == "page":
+            return
+        if key in self.flags and isinstance(value, bool):
+            self.flags[key][index] = int(value)
+        elif key == "dataType" and isinstance(value, str):
+            if value not in self.data_types:
+                self.data_types.append(value)
+            self.data_type[index] = self.data_types.index(value)
+        elif key == "human_page" and isinstance(value, int) and not isinstance(value, bool):
+            self.human_page[index] = value
+        elif isinstance(value, str) and key not in ("dataType", "human_page") and key not in self.flags:
+            column = self.texts.get(key)
+            if column is None:
+                column = self.texts[key] = [None] * self.total_pages
+            old = column[index]
+            column[index] = self._intern(value)
+            if old is not None:
+                self._release(old)
+        else:
+            if key in self.fields(index):
+                self.del_field(index, key)
+            self.extras.setdefault(index, {})[key] = value
+            return
+        if index in self.extras:
+            self.extras[index].pop(key, None)
+
+    def del_field(self, index, key):
+        found = False
+        if key in self.flags and self.flags[key][index] != UNSET:
+            self.flags[key][index] = UNSET
+            found = True
+        elif key == "dataType" and self.data_type[index] != UNSET:
+            self.data_type[index] = UNSET
+            found = True
+        elif key == "human_page" and self.human_page[index] != NO_HUMAN_PAGE:
+            self.human_page[index] = NO_HUMAN_PAGE
+            found = True
+        elif key in self.texts and self.texts[key][index] is not None:
+            self._release(self.texts[key][index])
+            self.texts[key][index] = None
+            found = True
+        extras = self.extras.get(index)
+        if extras is not None and key in extras:
+            del extras[key]
+            if not extras:
+                del self.extras[index]
+            found = True
+        if not found:
+            raise KeyError(key)
+
+    def fields(self, index):
+        keys = ["page"]
+        keys += [name for name in FLAGS if self.flags[name][index] != UNSET]
+        if self.data_type[index] != UNSET:
+            keys.append("dataType")
+        if self.human_page[index] != NO_HUMAN_PAGE:
+            keys.append("human_page")
+        keys += [method for method, column in self.texts.items() if column[index] is not None]
+        keys += list(self.extras.get(index, ()))
+        return keys
+
+    def set_first_human_page(self, first_human_page):
+        # human page numbers count from first_human_page, pages before it (or no offset at all) get -1
+        for index in range(self.total_pages):
+            page = index + 1
+            self.human_page[index] = page - first_human_page + 1 if (first_human_page != -1 and page - first_human_page >= 0) else -1
+
+    def to_records(self):
+        return [dict(PageView(self, index)) for index in range(self.total_pages)]
+
+    @classmethod
+    def from_records(cls, records, total_pages=None):
+        # records may be a generator when total_pages is given
+        if total_pages is None:
+            records = list(records)
+            total_pages = max((record["page"] for record in records), default=0)
+        store = cls(total_pages, is_data=None)
+        for record in records:
+            if not 0 < record["page"] <= total_pages:
+                continue
+            store[record["page"] - 1] = record
+        return store
+
+    def text_stats(self):
+        # (stored texts, distinct texts, characters kept) for the debug panel
+        slots = sum(1 for column in self.texts.values() for record in column if record is not None)
+        return slots, len(self.records), sum(len(text) for text in self.records)
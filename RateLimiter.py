@@ -0,0 +1,53 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def consume(self, amount):
+        # settles the difference between an estimate and the real cost, the bucket may go into debt
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+
+
+def is_retryable(e):
+    code = getattr(e, 'code', None)
+    return code == 429 or (isinstance(code, int) and 500 <= code < 600)
+
+
+def retry_with_backoff(fn, max_retries=5, base_delay=1.0, max_delay=60.0, retryable=is_retryable):
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not retryable(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f'retrying in {delay:.1f}s after: {e}')
+            time.sleep(delay)
+            attempt += 1
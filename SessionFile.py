@@ -0,0 +1,122 @@
+import json
+import re
+
+from PageStore import PageStore
+
+# a top-level key: inside page texts every quote is escaped, so an unescaped match can't come from a page
+TOTAL_PAGES_RE = re.compile(r'(?<!\\)"total_pages"\s*:\s*(-?\d+)')
+WHITESPACE_RE = re.compile(r'\s*')
+
+EMPTY_ROWS = ("", " ", None)
+
+
+class SessionFileError(ValueError):
+    pass
+
+
+def read_total_pages(text):
+    # new files write it first; older ones after the pages, so look from the end before scanning everything
+    match = TOTAL_PAGES_RE.search(text, 0, 1024)
+    pos = len(text)
+    while match is None and pos > 0:
+        pos = text.rfind('"total_pages"', 0, pos)
+        if pos == -1:
+            break
+        # the lookbehind still sees the character before pos, escaped occurrences don't match
+        match = TOTAL_PAGES_RE.match(text, pos)
+    if match is None:
+        raise SessionFileError('"total_pages" is missing')
+    return int(match.group(1))
+
+
+class _Reader:
+    # walks the top-level object with raw_decode, one member (or one page) at a time
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def skip(self):
+        self.pos = WHITESPACE_RE.match(self.text, self.pos).end()
+
+    def expect(self, char):
+        self.skip()
+        if self.text[self.pos:self.pos + 1] != char:
+            raise SessionFileError(f"expected '{char}' at position {self.pos}")
+        self.pos += 1
+
+    def peek(self):
+        self.skip()
+        return self.text[self.pos:self.pos + 1]
+
+    def value(self):
+        self.skip()
+        value, self.pos = self.decoder.raw_decode(self.text, self.pos)
+        return value
+
+    def array(self):
+        # yields the elements of an array without building it
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+    def members(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+
+def load_session(text, expected_pages=0):
+    # returns (PageStore or None, every other top-level value). total_pages is checked
+    # against expected_pages (0 = no pdf open yet) before any page is decoded.
+    total_pages = read_total_pages(text)
+    if expected_pages != 0 and expected_pages != total_pages:
+        raise SessionFileError(f'JSON and PDF page number not match: {total_pages}:{expected_pages}')
+    reader = _Reader(text)
+    pages = None
+    data = {}
+    for key in reader.members():
+        if key == "pages":
+            pages = PageStore.from_records(reader.array(), total_pages)
+        else:
+            data[key] = reader.value()
+    return pages, data
+
+
+def apply_list_edits(rows, delta):
+    # replays a data_editor delta over a list of strings in one pass
+    rows = list(rows)
+    for row, changes in (delta or {}).get("edited_rows", {}).items():
+        row = int(row)
+        if row < len(rows):
+            for value in changes.values():
+                rows[row] = value
+    for added in (delta or {}).get("added_rows", []):
+        rows.extend(added.values())
+    return [row for row in rows if row not in EMPTY_ROWS]
+
+
+def apply_index_edits(book_index, delta):
+    for row, changes in (delta or {}).get("edited_rows", {}).items():
+        row = int(row)
+        if row < len(book_index):
+            book_index[row].update(changes)
+    return book_index
@@ -0,0 +1,133 @@
+import copy
+import json
+import os
+import threading
+import weakref
+
+# path -> lock held while the file is written, shared by every journal of the process so compact
+# never swaps a file out under another journal's append (e.g. two tabs of one session)
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+def journal_path(digest, session_id):
+    # one journal per document and browser session, other users' edits are never offered for restore
+    return os.path.join(os.getenv('SESSION_DIR', os.path.join(os.getenv('CACHE_DIR', '.cache'), 'sessions')), f'{digest}.{session_id}.journal.jsonl')
+
+
+def file_lock(path):
+    with _file_locks_lock:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def _autosave(journal_ref, stopped, interval):
+    # holds the journal only while flushing, so a journal of an ended session is collected and the thread exits
+    while not stopped.wait(interval):
+        journal = journal_ref()
+        if journal is None:
+            return
+        try:
+            journal.flush()
+        except Exception as e:
+            print(f'autosave failed: {e}')
+        del journal
+
+
+class SessionJournal:
+    # append-only autosave: only pages marked dirty (and changed metadata) are written, by a background thread
+    def __init__(self, path, interval=None):
+        self.path = path
+        self.interval = float(interval if interval is not None else os.getenv('AUTOSAVE_SECONDS', 5))
+        self.lock = threading.Lock()
+        self.file_lock = file_lock(path)
+        self.dirty = {}
+        self.meta = None
+        self.saved_meta = None
+        self.records = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=_autosave, args=(weakref.ref(self), self.stopped, self.interval),
+                                       daemon=True, name='session-autosave')
+        self.thread.start()
+        # the session state going away stops the thread; dirty pages are flushed every interval before that
+        weakref.finalize(self, self.stopped.set)
+
+    def mark_page(self, page):
+        # a shallow copy is enough, page values are strings and flags; the saver thread never sees later mutations
+        with self.lock:
+            self.dirty[page["page"]] = dict(page)
+
+    def mark_meta(self, meta):
+        # keywords, index and offsets; compared with the last copy so an idle rerun writes nothing.
+        # returns True when the metadata changed since the previous call
+        with self.lock:
+            changed = meta != (self.meta if self.meta is not None else self.saved_meta)
+            if meta == self.saved_meta:
+                self.meta = None
+            elif changed:
+                self.meta = copy.deepcopy(meta)
+            return changed
+
+    def is_dirty(self):
+        with self.lock:
+            return bool(self.dirty) or self.meta is not None
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            meta, self.meta = self.meta, None
+        if not dirty and meta is None:
+            return 0
+        lines = [json.dumps({"page": page}, ensure_ascii=False) for _, page in sorted(dirty.items())]
+        if meta is not None:
+            lines.append(json.dumps({"meta": meta}, ensure_ascii=False))
+        with self.file_lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.records += len(lines)
+        if meta is not None:
+            with self.lock:
+                self.saved_meta = meta
+        return len(lines)
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+    def compact(self):
+        # rewrites the journal with only the latest record of each page
+        with self.file_lock:
+            pages, meta = self.replay(self.path)
+            if not pages and meta is None:
+                return pages, meta
+            lines = [json.dumps({"page": page}, ensure_ascii=False) for _, page in sorted(pages.items())]
+            if meta is not None:
+                lines.append(json.dumps({"meta": meta}, ensure_ascii=False))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("".join(line + "\n" for line in lines))
+            os.replace(tmp_path, self.path)
+            self.records = len(lines)
+        return pages, meta
+
+    @staticmethod
+    def replay(path):
+        # latest record wins: returns ({page number: page}, meta or None)
+        pages = {}
+        meta = None
+        if not os.path.exists(path):
+            return pages, meta
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by a crash
+                    continue
+                if "page" in record:
+                    pages[record["page"]["page"]] = record["page"]
+                elif "meta" in record:
+                    meta = record["meta"]
+        return pages, meta
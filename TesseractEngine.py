@@ -0,0 +1,51 @@
+import threading
+
+from LineLayout import PageLines
+
+
+class TesseractEngines:
+    # one tesserocr API per thread and language: the traineddata is loaded once and the engine is
+    # reused for every page, PIL images are handed over with SetImage instead of temp files and a subprocess
+    def __init__(self, tesserocr, path=None):
+        self.tesserocr = tesserocr
+        self.path = path
+        self.local = threading.local()
+
+    def api(self, lang):
+        apis = self.local.__dict__.setdefault('apis', {})
+        if lang not in apis:
+            kwargs = {"lang": lang}
+            if self.path:
+                kwargs["path"] = self.path
+            apis[lang] = self.tesserocr.PyTessBaseAPI(**kwargs)
+        return apis[lang]
+
+    def recognize(self, img, lang):
+        api = self.api(lang)
+        api.SetImage(img)
+        api.Recognize()
+        return api
+
+    def text(self, img, lang):
+        return self.recognize(img, lang).GetUTF8Text()
+
+    def page_lines(self, img, lang):
+        api = self.recognize(img, lang)
+        level = self.tesserocr.RIL.TEXTLINE
+        boxes, texts, conf = [], [], []
+        iterator = api.GetIterator()
+        if iterator is not None:
+            for line in self.tesserocr.iterate_level(iterator, level):
+                text = line.GetUTF8Text(level)
+                box = line.BoundingBox(level)
+                if not text or not text.strip() or box is None:
+                    continue
+                boxes.append(box)
+                texts.append(text.strip())
+                conf.append(max(0.0, line.Confidence(level)) / 100)
+        return PageLines(boxes, texts, conf, img.width)
+
+    def close(self):
+        # only the calling thread's engines
+        for api in self.local.__dict__.pop('apis', {}).values():
+            api.End()
@@ -0,0 +1,46 @@
+import os
+import re
+
+# Arabic, Arabic Supplement and the two presentation form blocks
+ARABIC_RE = re.compile('[\u0600-\u06ff\u0750-\u077f\ufb50-\ufdff\ufe70-\ufeff]+')
+PRESENTATION_RE = re.compile('[\ufb50-\ufdff\ufe70-\ufeff]+')
+LETTER_RE = re.compile(r'[^\W\d_]+')
+
+
+class TextLayerTriage:
+    # decides from PyMuPDF's text layer alone (no rendering) whether a page needs OCR
+    def __init__(self, min_chars=None, min_arabic=None, max_presentation=None, max_image_cover=None):
+        self.min_chars = int(min_chars if min_chars is not None else os.getenv('HYBRID_MIN_CHARS', 50))
+        self.min_arabic = float(min_arabic if min_arabic is not None else os.getenv('HYBRID_MIN_ARABIC', 0.5))
+        self.max_presentation = float(max_presentation if max_presentation is not None else os.getenv('HYBRID_MAX_PRESENTATION', 0.5))
+        self.max_image_cover = float(max_image_cover if max_image_cover is not None else os.getenv('HYBRID_MAX_IMAGE_COVER', 0.6))
+
+    @staticmethod
+    def score(page, text=None):
+        text = page.get_text() if text is None else text
+        letters = sum(map(len, LETTER_RE.findall(text)))
+        arabic = sum(map(len, ARABIC_RE.findall(text)))
+        presentation = sum(map(len, PRESENTATION_RE.findall(text)))
+        area = abs(page.rect) or 1
+        covered = 0
+        for info in page.get_image_info():
+            # overlapping images may count twice, capped at the page area below
+            covered += abs(page.rect & info["bbox"])
+        return {
+            "chars": len(text) - text.count(' ') - text.count('\n'),
+            "arabic": min(1.0, arabic / letters) if letters else 0.0,
+            "presentation": presentation / arabic if arabic else 0.0,
+            "image_cover": min(1.0, covered / area),
+        }
+
+    def route(self, score):
+        # (needs_ocr, reason)
+        if score["chars"] < self.min_chars:
+            return True, "no text layer"
+        if score["image_cover"] >= self.max_image_cover:
+            return True, "scanned"
+        if score["arabic"] < self.min_arabic:
+            return True, "not arabic script"
+        if score["presentation"] > self.max_presentation:
+            return True, "presentation forms"
+        return False, "text layer"
@@ -0,0 +1,120 @@
+import re
+import string
+
+# contextual (presentation) forms and Arabic variants -> general Persian characters
+GLUE_SRC = ',?%1234567890;“”ﭘﺮﺯﻭﺻكىيﻬ٧ﺍﭙﺚﻖﯿﮎﺗﯼيﺴﻯﮥﺻﯾﺸﺿﻔﻐﻴﺞ٦ﻡےكﻩﺟﺜﻥﺰﻟﭻﻰﻣﻉﻳﺪﻤﺒ٤ﺫﺠﻲﺳﻓﺭﺨﮏﺕﻧﺵﮑ١ﮔﻗ٢ﺘﻱﻭﮯ٥ٱﻫﺩ٨ﻏﻦﻠﺺﺼﭘﺖﺏﻕﺲﺷۀﻎﻝﭽﻮﻑﺶﻨﺮﮕﮐﺣ٩٠٣ةﻍﺝﻒﭼﮓﺹﻌﯽﺛﻄڪﺬﻃﻢﻋﺑﺧﻂﺤﺥﻊﺁﻜﻞﺦﻛﺎﺯﻘﺱﻪہﺐى'
+GLUE_TRG = '،؟٪۱۲۳۴۵۶۷۸۹۰؛""پرزوصکییه۷اپثقیکتییسیهصیشضفغیج۶میکهجثنزلچیمعیدمب۴ذجیسفرخکتنشک۱گق۲تیویهاهد۸غنلصصپتبقسشهغلچوفشنرگکح۹۰۳هغجفچگصعیثطکذطمعبخطحخعآکلخکازقسههبی'
+
+FARSI_DIGITS = "۱۲۳۴۵۶۷۸۹۰٠٩٨٧٦٥٤٣٢١"
+LATIN_DIGITS = "12345678900987654321"
+
+DIACRITICS = ''.join([chr(x) for x in list(range(0x64b, 0x652)) + [1648, 1618]])
+
+# joins pages for batch calls; untouched by every step (no letters, digits, punctuation, or diacritics)
+PAGE_SEPARATOR = '\n\x00\n'
+
+
+def _glue_table():
+    table = str.maketrans(GLUE_SRC, GLUE_TRG)
+    table[172] = 8204 # converting Microsoft Word ZWNJ to the unicode standard ZWNJ
+    return table
+
+
+def _reverse_match(match):
+    return match.group(0)[::-1]
+
+
+def _reverse_lines(text):
+    # same as reversing the whole text and then the order of its lines
+    return '\n'.join(text[::-1].split('\n')[::-1])
+
+
+class TextNormalizer:
+    # steps run in order; neighbouring translate steps are merged into one table and
+    # every pattern is compiled once, so a chain costs one pass per group instead of per step
+    def __init__(self, steps=("glue",)):
+        self.steps = list(steps)
+        self.passes = []
+        # a replacement touching line breaks could cross or eat the separator between batched pages
+        self.batch_safe = not any(isinstance(step, (tuple, list)) and any('\n' in a or '\x00' in a for a in step[1:])
+                                  for step in self.steps)
+        for step in self.steps:
+            kind, arg = self._compile_step(step)
+            if kind == 'translate' and self.passes and self.passes[-1][0] == 'translate':
+                self.passes[-1] = ('translate', self._compose(self.passes[-1][1], arg))
+            else:
+                self.passes.append((kind, arg))
+        self.passes = [('translate', self._dense(arg)) if kind == 'translate' else (kind, arg) for kind, arg in self.passes]
+
+    @staticmethod
+    def _compile_step(step):
+        if isinstance(step, (tuple, list)):
+            name, *args = step
+        else:
+            name, args = step, []
+        if name == "glue":
+            return 'translate', _glue_table()
+        if name == "digits":
+            return 'translate', str.maketrans(FARSI_DIGITS, LATIN_DIGITS)
+        if name == "diacritics":
+            pattern = re.compile(' ?[' + DIACRITICS + ']+')
+            return 'function', lambda text: pattern.sub('', text)
+        if name == "lefties":
+            # latin/punctuation runs and digit runs are disjoint, one alternation reverses both
+            pattern = re.compile('[A-Za-z' + string.punctuation + ']+|\\d+')
+            return 'function', lambda text: pattern.sub(_reverse_match, text)
+        if name == "plumber":
+            return 'function', _reverse_lines
+        if name == "replace":
+            old, new = args
+            return 'function', lambda text: text.replace(old, new)
+        raise ValueError(f"Unknown normalization step: {name}")
+
+    @staticmethod
+    def _compose(first, second):
+        # a table equivalent to text.translate(first).translate(second)
+        table = {}
+        for src, trg in first.items():
+            if trg is None:
+                table[src] = None
+            else:
+                trg = chr(trg) if isinstance(trg, int) else trg
+                table[src] = trg.translate(second)
+        for src, trg in second.items():
+            table.setdefault(src, trg)
+        return table
+
+    @staticmethod
+    def _dense(table):
+        # str.translate indexes a list about twice as fast as it looks up a dict;
+        # code points past the end raise IndexError and are left unchanged
+        dense = list(range(max(table) + 1))
+        for src, trg in table.items():
+            dense[src] = trg
+        return dense
+
+    _shared = {}
+
+    @classmethod
+    def shared(cls, steps):
+        # compiled engines are reused, the dense tables are a few MB each
+        key = repr(list(steps))
+        if key not in cls._shared:
+            cls._shared[key] = cls(steps)
+        return cls._shared[key]
+
+    def normalize(self, text):
+        for kind, arg in self.passes:
+            text = text.translate(arg) if kind == 'translate' else arg(text)
+        return text
+
+    __call__ = normalize
+
+    def normalize_many(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        if not self.batch_safe or any('\x00' in t for t in texts):
+            return [self.normalize(t) for t in texts]
+        # one pass per group over all pages instead of one per page
+        return self.normalize(PAGE_SEPARATOR.join(texts)).split(PAGE_SEPARATOR)
@@ -0,0 +1,57 @@
+import hashlib
+import os
+import threading
+import time
+
+
+class UploadSpool:
+    # uploaded pdfs stored once under their sha256, shared by every session that uploads the same file
+    def __init__(self, path=None, max_files=None):
+        self.path = path or os.getenv('SPOOL_DIR', os.path.join(os.getenv('CACHE_DIR', '.cache'), 'uploads'))
+        self.max_files = int(max_files if max_files is not None else os.getenv('SPOOL_MAX_FILES', 20))
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def hash_bytes(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def file_path(self, digest):
+        return os.path.join(self.path, f'{digest}.pdf')
+
+    def store(self, data, digest=None):
+        # data is any bytes-like object (an uploaded file's getbuffer() avoids a copy); returns (digest, path)
+        digest = digest or self.hash_bytes(data)
+        path = self.file_path(digest)
+        with self.lock:
+            if os.path.exists(path):
+                os.utime(path) # marks it as recently used for gc
+            else:
+                tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+        return digest, path
+
+    def gc(self, keep=()):
+        # removes the least recently used files past max_files, digests in keep (open documents) stay
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.path):
+                path = os.path.join(self.path, name)
+                if name.endswith('.tmp'):
+                    # left behind by an interrupted store
+                    if time.time() - os.path.getmtime(path) > 3600:
+                        os.remove(path)
+                    continue
+                if name.endswith('.pdf') and name[:-4] not in keep:
+                    entries.append((os.path.getmtime(path), path))
+            entries.sort()
+            removed = 0
+            for _, path in entries[:max(0, len(entries) - self.max_files)]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            return removed
@@ -1,11 +1,24 @@
 import streamlit as st
 import os
-import tempfile
 import re
 import string
 import json
+import uuid
 from datetime import datetime
-from PDFProcessor import PDFProcessor
+from PDFProcessor import PDFProcessor, backends, COMPARE_METHODS
+from ExtractionCache import ExtractionCache
+from PageRenderCache import PageRenderCache
+from DocumentPool import DocumentPool
+from JsonLinesWriter import JsonLinesWriter
+from Metrics import metrics
+from JobRunner import JobRunner, PRIORITY_BOOK, PRIORITY_PAGE
+from TextNormalizer import TextNormalizer
+from EditJournal import EditJournal, remove_diacritics_edit, replace_edit, glue_edit
+from PagePrefetcher import PagePrefetcher
+from PageStore import PageStore
+from UploadSpool import UploadSpool
+from SessionFile import load_session, apply_list_edits, apply_index_edits, SessionFileError
+from SessionJournal import SessionJournal, journal_path
 from dotenv import load_dotenv
 import fitz
 import base64
@@ -15,20 +28,36 @@ import time
 
 load_dotenv()
 
+glue_chars = TextNormalizer.shared(["glue"])
+
+# the viewer template is read once, not on every rerun
+with open("custom_html.html",'r') as f:
+    VIEWER_TEMPLATE = f.read()
+
 def normalize(text):
-  
-  srcLine = ',?%1234567890;“”ﭘﺮﺯﻭﺻكىيﻬ٧ﺍﭙﺚﻖﯿﮎﺗﯼيﺴﻯﮥﺻﯾﺸﺿﻔﻐﻴﺞ٦ﻡےكﻩﺟﺜﻥﺰﻟﭻﻰﻣﻉﻳﺪﻤﺒ٤ﺫﺠﻲﺳﻓﺭﺨﮏﺕﻧﺵﮑ١ﮔﻗ٢ﺘﻱﻭﮯ٥ٱﻫﺩ٨ﻏﻦﻠﺺﺼﭘﺖﺏﻕﺲﺷۀﻎﻝﭽﻮﻑﺶﻨﺮﮕﮐﺣ٩٠٣ةﻍﺝﻒﭼﮓﺹﻌﯽﺛﻄڪﺬﻃﻢﻋﺑﺧﻂﺤﺥﻊﺁﻜﻞﺦﻛﺎﺯﻘﺱﻪہﺐى'
-  trgLine = '،؟٪۱۲۳۴۵۶۷۸۹۰؛""پرزوصکییه۷اپثقیکتییسیهصیشضفغیج۶میکهجثنزلچیمعیدمب۴ذجیسفرخکتنشک۱گق۲تیویهاهد۸غنلصصپتبقسشهغلچوفشنرگکح۹۰۳هغجفچگصعیثطکذطمعبخطحخعآکلخکازقسههبی'
+  return glue_chars.normalize(text)
 
-  repl = str.maketrans(srcLine, trgLine)
-  repl[172] = 8204 # converting Microsoft Word ZWNJ to the unicode standard ZWNJ
-  return text.translate(repl)
+def session_meta():
+    # everything saved besides the pages
+    meta = {
+        "total_pages": st.session_state.total_pages,
+        "first_human_page": st.session_state.first_human_page,
+        "keywords": st.session_state.keywords,
+        "ttypes": st.session_state.ttypes,
+        "ppairs": st.session_state.ppairs,
+        "uploaded_filename": st.session_state.get('uploaded_filename', 'Unknown'),
+        "book_index": st.session_state.book_index,
+    }
+    for key in ["book_index_edited", "keywords_edited", "types_edited", "pairs_edited"]:
+        if key in st.session_state:
+            meta[key] = st.session_state[key]
+    return meta
 
-def save_session_state():
+def build_session_json():
     # Collect relevant session state data
+    # total_pages goes first and pages last, so a loader can check the page count before reading any page
     save_data = {
         #"page_num": st.session_state.page_num,
-        "pages": st.session_state.pages,
         "total_pages": st.session_state.total_pages,
         "first_human_page": st.session_state.first_human_page,
         #"zoom_level": st.session_state.zoom_level,
@@ -56,225 +85,335 @@ def save_session_state():
     if "pairs_edited" in st.session_state:
         save_data["pairs_edited"] = st.session_state.pairs_edited
 
-    # Convert to JSON and encode
-    json_data = json.dumps(save_data, ensure_ascii=False)
-    encoded_data = base64.b64encode(json_data.encode()).decode()
-    
-    # Create download button
+    save_data["pages"] = st.session_state.pages.to_records()
+    return json.dumps(save_data, ensure_ascii=False)
+
+def prepare_export():
+    st.session_state.export_json = build_session_json()
+
+def save_session_state():
+    # the full JSON is only built when asked for, the autosave journal covers everything else
+    if "export_json" not in st.session_state:
+        st.sidebar.button("📥 Prepare Session State", on_click=prepare_export, help='Build the session file for download')
+        return
     st.sidebar.download_button(
         label="📥 Save Session State",
-        data=json_data, #encoded_data,
+        data=st.session_state.export_json,
         file_name=f"{st.session_state.get('uploaded_filename', 'Unknown').split('.pdf')[0]}.json",
         mime="application/json",
+        on_click=lambda: st.session_state.pop("export_json", None),
     )
 
+def session_id():
+    # kept in the url, so reloading the page finds this session's autosave again
+    if "session_id" not in st.session_state:
+        value = st.query_params.get("session", "")
+        if not re.fullmatch(r"[0-9a-f]{32}", value):
+            value = uuid.uuid4().hex
+            st.query_params["session"] = value
+        st.session_state.session_id = value
+    return st.session_state.session_id
+
+def open_session_journal(digest):
+    # one autosave journal per document and session, replaying an older one is offered as "Restore autosave"
+    path = journal_path(digest, session_id())
+    journal = st.session_state.get("session_journal")
+    if journal is not None and journal.path == path:
+        return journal
+    if journal is not None:
+        journal.close()
+    journal = SessionJournal(path)
+    pages, meta = journal.compact()
+    st.session_state.autosave = (pages, meta) if pages or meta else None
+    st.session_state.session_journal = journal
+    return journal
+
+def mark_dirty(page_indices):
+    # a prepared export is stale after any change, with or without a journal
+    st.session_state.pop("export_json", None)
+    journal = st.session_state.get("session_journal")
+    if journal is None:
+        return
+    for i in page_indices:
+        journal.mark_page(st.session_state.pages[i])
+
+def restore_autosave():
+    pages, meta = st.session_state.autosave
+    for page in pages.values():
+        if 0 < page["page"] <= len(st.session_state.pages):
+            st.session_state.pages[page["page"] - 1] = page
+            if f"page_text_{page['page']}" in st.session_state:
+                del st.session_state[f"page_text_{page['page']}"]
+    if meta:
+        for key in ["first_human_page", "keywords", "ttypes", "ppairs", "book_index"]:
+            if key in meta:
+                st.session_state[key] = meta[key]
+        st.session_state.session_journal.saved_meta = meta
+    st.session_state.autosave = None
+
+@st.cache_resource
+def get_document_pool():
+    return DocumentPool(plumber_loader=lambda: backends.get("pdfplumber"))
+
+@st.cache_resource
+def get_job_runner():
+    # shared by all sessions, JOB_MAX_CONCURRENT bounds the jobs running on the server
+    return JobRunner()
+
+@st.cache_resource
+def get_upload_spool():
+    return UploadSpool()
+
 @st.cache_resource
+def get_extraction_cache():
+    cache = ExtractionCache()
+    metrics.add_collector("extraction_cache", cache.stats)
+    return cache
+
+@st.cache_resource
+def get_render_cache():
+    cache = PageRenderCache()
+    metrics.add_collector("render_cache", cache.stats)
+    return cache
+
 def get_processor():
-    return PDFProcessor()
+    # one processor per browser session, the caches and open documents are shared by all sessions
+    if "processor" not in st.session_state:
+        st.session_state.processor = PDFProcessor(get_extraction_cache(), get_render_cache(), get_document_pool())
+    return st.session_state.processor
+
+def open_jsonl_writer(extraction_method, fresh=False):
+    # fresh: the run covers every page, an earlier file of the book is replaced instead of added to
+    output_dir = os.getenv('JSONL_OUTPUT_DIR')
+    if not output_dir:
+        return None
+    name = st.session_state.get('uploaded_filename', 'Unknown').split('.pdf')[0]
+    method = re.sub(r'[^\w-]+', '_', extraction_method)
+    return JsonLinesWriter(os.path.join(output_dir, f"{name}.{method}.jsonl"), mode='w' if fresh else 'a')
+
+def job_options(extraction_method):
+    options = {}
+    if extraction_method == "surya":
+        options = {"batch_size": int(st.session_state.get("surya_batch_size", 8)), "x": int(st.session_state.get("col_center") or 0)}
+    if extraction_method == "tesseract":
+        options = {"x": int(st.session_state.get("col_center") or 0)}
+    if extraction_method == "hybrid":
+        # hybrid hands the ones its OCR backend takes on
+        options = {"x": int(st.session_state.get("col_center") or 0), "batch_size": int(st.session_state.get("surya_batch_size", 8)),
+                   "max_in_flight": int(st.session_state.get("gemini_in_flight", 4))}
+    if extraction_method == "gemini-2-flash":
+        options = {"max_in_flight": int(st.session_state.get("gemini_in_flight", 4))}
+    return options
 
-def process_pdf(processor, pdf_path, extraction_method):
+def jsonl_record(record, extraction_method):
+    if extraction_method == "All Methods":
+        return record | {"method": extraction_method}
+    return {key: value for key, value in record.items() if key in ("page", "text", "route", "reason")} | {"method": extraction_method}
+
+def start_parse_job(processor, extraction_method, workers=1, page_range=None, priority=PRIORITY_BOOK):
+    # "Parse All" runs as a background job, its pages land in the session as they complete
+    page_range = page_range or list(range(1, len(processor.doc) + 1))
+    if extraction_method == "gemini-2-flash":
+        page_range = [page for page in page_range if st.session_state.pages.get(page, "gemini-2-flash") is None]
+    if len(page_range) == 0:
+        return
+
+    # the job reads through its own processor, the session's one may open another document meanwhile
+    job_processor = PDFProcessor(get_extraction_cache(), get_render_cache(), get_document_pool())
+    job_processor.load_document(processor.doc_path, processor.doc_hash)
+    job_processor.preprocess = processor.preprocess
+    job_processor.temp_pdf_path = processor.temp_pdf_path
+    job_processor.open_workers(workers)
+    if extraction_method == "All Methods":
+        methods = st.session_state.get("compare_methods", COMPARE_METHODS)
+        x = int(st.session_state.get("col_center") or 0)
+        max_in_flight = int(st.session_state.get("gemini_in_flight", 4))
+        def extract(pages):
+            return job_processor.iter_compare([page - 1 for page in pages], methods, x, max_in_flight=max_in_flight)
+    else:
+        options = job_options(extraction_method)
+        def extract(pages):
+            return job_processor.iter_pages(extraction_method, pages, workers, **options)
+
+    writer = open_jsonl_writer(extraction_method, fresh=priority == PRIORITY_BOOK and len(page_range) == len(processor.doc))
+    def on_record(record):
+        if writer:
+            writer.write(jsonl_record(record, extraction_method))
+
+    def on_finish(job):
+        if writer:
+            writer.close()
+        job_processor.cleanup(remove_file=False)
+        if job.started:
+            metrics.observe("parse_all" if priority == PRIORITY_BOOK else "parse_page", job.finished_at - job.started,
+                            method=extraction_method, doc=processor.doc_hash)
+        metrics.write()
+
+    job = get_job_runner().submit(extract, page_range, label=extraction_method, priority=priority,
+                                  chunk_size=max(int(os.getenv('JOB_CHUNK_PAGES', 16)), workers * 4),
+                                  on_record=on_record, on_finish=on_finish)
+    st.session_state.jobs[job.id] = (extraction_method, processor.doc_hash)
+
+def jump_queue(processor, extraction_method):
+    # the page on screen leaves the running parse of its method for a page job of its own, ahead of every book
+    page_num = st.session_state.page_num
+    if st.session_state.pages.get(page_num, extraction_method) is not None:
+        return
+    for job_id, (method, doc_hash) in list(st.session_state.jobs.items()):
+        job = get_job_runner().get(job_id)
+        # only a book gives the page up, a page job holding it already runs ahead of them
+        if job is None or job.priority == PRIORITY_PAGE or method != extraction_method or doc_hash != processor.doc_hash:
+            continue
+        if job.take(page_num):
+            start_parse_job(processor, method, page_range=[page_num], priority=PRIORITY_PAGE)
+            break
+
+def store_record(record, extraction_method):
+    # one page a job finished, into the session
+    page = st.session_state.pages[record["page"] - 1]
+    if extraction_method == "All Methods":
+        for method, result in record["methods"].items():
+            if result["text"] is not None:
+                page[method] = result["text"]
+        # cached pages took no time, they are left out of the timings
+        st.session_state.compare_timings[record["page"] - 1] = {"render": record["render"]} | {
+            method: result["seconds"] for method, result in record["methods"].items() if not result.get("cached")}
+    else:
+        page[extraction_method] = record["text"]
+        if "route" in record:
+            page["hybrid_route"] = record["route"]
+            page["hybrid_reason"] = record["reason"]
+    mark_dirty([record["page"] - 1])
+
+def collect_jobs(processor):
+    # moves what the session's jobs finished into the pages; True when one of the jobs ended
+    runner = get_job_runner()
+    ended = False
+    for job_id, (method, doc_hash) in list(st.session_state.jobs.items()):
+        job = runner.get(job_id)
+        if job is None:
+            del st.session_state.jobs[job_id]
+            continue
+        # read before draining, a finished job has nothing left to add
+        finished = job.finished
+        records = job.drain()
+        if doc_hash != processor.doc_hash:
+            # another PDF was opened since
+            runner.cancel(job_id)
+        else:
+            for record in records:
+                store_record(record, method)
+        if finished:
+            if job.error:
+                st.toast(f"{method} failed after {job.done} pages: {job.error}")
+            elif job.priority != PRIORITY_PAGE:
+                st.toast(f"{method}: {job.done} of {job.total} pages extracted" + (" (stopped)" if job.state == "cancelled" else ""))
+            runner.forget(job_id)
+            del st.session_state.jobs[job_id]
+            ended = True
+    return ended
+
+def show_jobs(processor, extraction_method):
+    # polled while the session has jobs; the whole app reruns once a job ends or the page on screen arrives
+    page_num = st.session_state.page_num
+    waiting = st.session_state.pages.get(page_num, extraction_method) is None
+    ended = collect_jobs(processor)
+    runner = get_job_runner()
+    for job_id, (method, _) in st.session_state.jobs.items():
+        job = runner.get(job_id)
+        # gone after JOB_KEEP_SECONDS, or a page job
+        if job is None or job.priority == PRIORITY_PAGE:
+            continue
+        progress = job.progress()
+        st.progress(progress["done"] / max(1, progress["total"]),
+                    text=f"{method}: {progress['done']}/{progress['total']} pages, {progress['pages_per_s']:.2f} pages/s ({progress['state']})")
+        st.button("Stop", key=f"stop_job_{job_id}", on_click=runner.cancel, args=(job_id,))
+    if ended or (waiting and st.session_state.pages.get(page_num, extraction_method) is not None):
+        st.rerun()
+
+def compare_summary(timings):
+    # seconds per engine over the compared pages
+    rows = {}
+    for page_timings in timings.values():
+        for method, seconds in page_timings.items():
+            row = rows.setdefault(method, {"method": method, "pages": 0, "total s": 0.0, "max s": 0.0})
+            row["pages"] += 1
+            row["total s"] += seconds
+            row["max s"] = max(row["max s"], seconds)
+    for row in rows.values():
+        row["mean s"] = row["total s"] / row["pages"]
+    return list(rows.values())
+
+def process_pdf(processor, pdf_path, extraction_method, workers=1):
     results = []
+
+    # page by page methods run as background jobs
+    if extraction_method in ["pdfplumber", "PyMuPDF", "tesseract", "surya", "gemini-2-flash", "pdf2image/tesseract", "hybrid", "All Methods"]:
+        start_parse_job(processor, extraction_method, workers)
     
-    if extraction_method == "pdfplumber" or extraction_method == "All Methods":
-        plumber_results = processor.process_with_pdfplumber(pdf_path)
-        for r in plumber_results:
-            r["method"] = "pdfplumber"
-            r["pdfplumber"] = r["text"]
-            del r["text"]
-        results.extend(plumber_results)
-    
-    if extraction_method == "PyMuPDF" or extraction_method == "All Methods":
-        pymupdf_results = processor.process_with_pymupdf(pdf_path)
-        for r in pymupdf_results:
-            r["method"] = "PyMuPDF"
-            r["PyMuPDF"] = r["text"]
-            del r["text"]
-        results.extend(pymupdf_results)
-    
-    if extraction_method in ["doctr (OCR)", "All Methods"]:
+    if extraction_method == "doctr (OCR)":
         doctr_results = processor.process_with_doctr(pdf_path)
         for r in doctr_results:
             r["method"] = "doctr"
-            r["doctr"] = r["text"]
-            del r["text"]
         results.extend(doctr_results)
-    
-    if extraction_method == "pdf2image/tesseract" or extraction_method == "All Methods":
-        tesser_results = processor.process_with_pdf2image_tesseract(pdf_path)
-        for r in tesser_results:
-            r["method"] = "pdf2image/tesseract"
-        results.extend(tesser_results)
-    
-    if extraction_method == "tesseract" or extraction_method == "All Methods":
-        tesser_results = processor.process_with_tesseract(pdf_path)
-        for r in tesser_results:
-            r["method"] = "tesseract"
-            r["tesseract"] = r["text"]
-            del r["text"]
-        results.extend(tesser_results)
-    
-    if extraction_method == "gemini-2-flash":
-        progress_text = "Parsing pages..."
-        st.session_state.stop_parse_process = False
-        if st.button("Stop"):
-            st.session_state.stop_parse_process = True
-        my_bar = st.progress(0, text=progress_text)
-        pdf_length = len(processor.doc)
-
-        for page_num in range(pdf_length):
-            
-            if "gemini-2-flash" not in st.session_state.pages[page_num]:
-                page_text = processor.gemini_single_page(page_num)
-                st.session_state.pages[page_num]["gemini-2-flash"] = page_text
-            else:
-                pass
-            
-            if st.session_state.stop_parse_process:
-                break
-            print(page_num)
-            my_bar.progress(page_num/pdf_length, text=progress_text)
-            time.sleep(2)
-
-        time.sleep(1)
-        my_bar.empty()
 
     return results
 
 def reset_session():
-    st.session_state.stop_parse_process = False
+    for job_id in st.session_state.get("jobs", {}):
+        get_job_runner().cancel(job_id)
+    st.session_state.jobs = {}
     st.session_state.page_num = 1
-    st.session_state.pages = []
+    st.session_state.pages = PageStore()
     st.session_state.total_pages = 0
     st.session_state.first_human_page = -1
     st.session_state.zoom_level = 100
     st.session_state.keywords = []
     st.session_state.ttypes = []
     st.session_state.ppairs = []
+    st.session_state.compare_timings = {}
     st.session_state["uploader_pdf_key"] = 1
     st.session_state["uploader_json_key"] = 1000
     st.session_state["parse_page"] = False
 
 def load_json_state(file_content):
     try:
-        save_data = json.loads(file_content)
-        
-        # First verify total pages match
-        if (st.session_state.get('total_pages', 0) != 0 and 
-            st.session_state.get('total_pages', 0) != save_data['total_pages']):
-            st.error(f'JSON and PDF page number not match: {str(save_data["total_pages"])}:{str(st.session_state.get("total_pages", 0))}')
-            return False
-        
-        #if "pages" not in st.session_state or len(st.session_state.pages) == 0:
-            #st.session_state['pages'] = [{"page": x} for x in range(1, st.session_state.total_pages + 1)]
-
-        # Restore basic session state
-        for key, value in save_data.items():
-            if key not in ['save_timestamp', "extraction_method", "cached_pages", "pages", "keywords", "ppairs", "ttypes", "book_index_edited", "keywords_edited", "types_edited", "pairs_edited"]:
-                #setattr(st.session_state, key, value)
-                st.session_state[key] = value
-            if key == 'pages':
-                #for p in save_data[key]:
-                    #st.session_state.pages[p["page"] - 1] = p
-                st.session_state["pages"] = save_data["pages"]
-            if key == 'book_index_edited':
-                if "edited_rows" in value and len(value["edited_rows"].items()) > 0:
-                    print('hI tHeRe')
-                    for item in value['edited_rows'].items():
-                        print('-', item)
-                        k, v = item
-                        print(k, v)
-                        for k2, v2 in v.items():
-                            print("\t", k2, v2)
-                            st.session_state["book_index"][int(k)][k2] = v2
-
-            if key == 'keywords':
-                print('right here')
-                for kw in save_data[key]:
-                    st.session_state[key].append(kw)
-                if len(st.session_state[key]) == 0:
-                    st.session_state[key].append('')
-            if key == "keywords_edited":
-                if "edited_rows" in value and len(value["edited_rows"].items()) > 0:
-                    for item in value["edited_rows"].items():
-                        print('-', item)
-                        k, v = item
-                        print(k, v)
-                        for k2, v2 in v.items():
-                            print("\t", k2, v2)
-                            st.session_state["keywords"][int(k)] = v2
-                            #s.session_state["keywords"].append()
-                if "added_rows" in value and len(value["added_rows"]) > 0:
-                    for item in value["added_rows"]:
-                        for k2, v2 in item.items():
-                            print('ADDED_ROW:', k2, v2)
-                            st.session_state["keywords"].append(v2)
-                st.session_state["keywords"] = [x for x in st.session_state["keywords"] if x not in ["", " ", None]]
-
-            if key == 'ppairs':
-                for kw in save_data[key]:
-                    st.session_state[key].append(kw)
-                if len(st.session_state[key]) == 0:
-                    st.session_state[key].append('')
-            if key == "pairs_edited":
-                if "edited_rows" in value and len(value["edited_rows"].items()) > 0:
-                    for item in value["edited_rows"].items():
-                        print('-', item)
-                        k, v = item
-                        print(k, v)
-                        for k2, v2 in v.items():
-                            print("\t", k2, v2)
-                            st.session_state["ppairs"][int(k)] = v2
-                if "added_rows" in value and len(value["added_rows"]) > 0:
-                    for item in value["added_rows"]:
-                        for k2, v2 in item.items():
-                            print('ADDED_ROW:', k2, v2)
-                            st.session_state["ppairs"].append(v2)
-                st.session_state["ppairs"] = [x for x in st.session_state["ppairs"] if x not in ["", " ", None]]
-            
-            if key == 'ttypes':
-                for kw in save_data[key]:
-                    st.session_state[key].append(kw)
-                if len(st.session_state[key]) == 0:
-                    st.session_state[key].append('')
-            if key == "types_edited":
-                if "edited_rows" in value and len(value["edited_rows"].items()) > 0:
-                    for item in value["edited_rows"].items():
-                        print('-', item)
-                        k, v = item
-                        print(k, v)
-                        for k2, v2 in v.items():
-                            print("\t", k2, v2)
-                            st.session_state["ttypes"][int(k)] = v2
-                if "added_rows" in value and len(value["added_rows"]) > 0:
-                    for item in value["added_rows"]:
-                        for k2, v2 in item.items():
-                            print('ADDED_ROW:', k2, v2)
-                            st.session_state["ttypes"].append(v2)
-                st.session_state["ttypes"] = [x for x in st.session_state["ttypes"] if x not in ["", " ", None]]
-
-            
-        # Restore cached pages
-        #if "cached_pages" in save_data:
-            #for cache_key, cache_value in save_data["cached_pages"].items():
-                #st.session_state[cache_key] = cache_value
-        # Clear existing cached pages
-
-        #keys_to_remove = [key for key in st.session_state.keys() if key.startswith("cached_page_")]
-        #for key in keys_to_remove:
-        #    del st.session_state[key]
-
-        #for page in st.session_state.results:
-        #    if st.session_state.page_num - 1  == page['page']:
-        #        st.session_state[f"cached_page_{st.session_state.page_num-1}"] = page['text']
-        #    elif st.session_state.page_num  == page['page']:
-        #        st.session_state[f"cached_page_{st.session_state.page_num}"] = page['text']
-                
-        st.success(f"Session loaded successfully! (Saved on: {save_data['save_timestamp']})")
-        return True
+        # total_pages is checked before any page is decoded
+        pages, save_data = load_session(file_content, st.session_state.get('total_pages', 0))
+    except SessionFileError as e:
+        st.error(str(e))
+        return False
     except Exception as e:
         st.error(f"Error loading session state: {str(e)}")
         return False
 
+    # Restore basic session state
+    for key, value in save_data.items():
+        if key not in ['save_timestamp', "extraction_method", "cached_pages", "keywords", "ppairs", "ttypes", "book_index_edited", "keywords_edited", "types_edited", "pairs_edited"]:
+            st.session_state[key] = value
+    st.session_state.total_pages = save_data.get("total_pages", st.session_state.get('total_pages', 0))
+    if pages is not None:
+        st.session_state["pages"] = pages
+        st.session_state.pop("human_page_offset", None)
+
+    if "book_index" in save_data and "book_index_edited" in save_data:
+        st.session_state["book_index"] = apply_index_edits(st.session_state["book_index"], save_data["book_index_edited"])
+
+    # the saved lists replace the current ones, loading the same file twice doesn't duplicate them
+    for key, edited_key in [("keywords", "keywords_edited"), ("ppairs", "pairs_edited"), ("ttypes", "types_edited")]:
+        if key not in save_data:
+            continue
+        if edited_key in save_data:
+            st.session_state[key] = apply_list_edits(save_data[key], save_data[edited_key])
+        else:
+            st.session_state[key] = list(save_data[key]) or ['']
+
+    # the loaded pages replace the autosaved and exported state from before the load
+    mark_dirty(range(len(st.session_state["pages"])))
+
+    st.success(f"Session loaded successfully! (Saved on: {save_data.get('save_timestamp', 'unknown')})")
+    return True
+
 def reindex_pages():
     last_section_index = None
     last_lesson_index = None
@@ -302,12 +441,13 @@ def main():
     st.set_page_config(layout="wide")
 
     # Initialize session states
-    if 'stop_parse_process' not in st.session_state:
-        st.session_state.stop_parse_process = False
+    if 'jobs' not in st.session_state:
+        # job id -> (method, document hash) of the session's background parses
+        st.session_state.jobs = {}
     if 'page_num' not in st.session_state:
         st.session_state.page_num = 1
     if 'pages' not in st.session_state:
-        st.session_state.pages = []
+        st.session_state.pages = PageStore()
     if 'total_pages' not in st.session_state:
         st.session_state.total_pages = 0
     if 'first_human_page' not in st.session_state:
@@ -320,6 +460,8 @@ def main():
         st.session_state.ttypes = []
     if 'ppairs' not in st.session_state:
         st.session_state.ppairs = []
+    if 'compare_timings' not in st.session_state:
+        st.session_state.compare_timings = {}
     if "uploader_pdf_key" not in st.session_state:
         st.session_state["uploader_pdf_key"] = 1
     if "uploader_json_key" not in st.session_state:
@@ -332,7 +474,11 @@ def main():
         st.session_state.is_json_loaded = False
     if 'showIndex' not in st.session_state:
         st.session_state.showIndex = False
+    if 'edit_journal' not in st.session_state:
+        st.session_state.edit_journal = EditJournal()
     processor = get_processor()
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = PagePrefetcher(processor)
 
     def reset():
         #reset_session()
@@ -377,22 +523,51 @@ def main():
     st.title("PDF Content Extractor")
     
     def parse():
-        all_pages = process_pdf(processor, processor.temp_pdf_path, extraction_method)
+        all_pages = process_pdf(processor, processor.temp_pdf_path, selected_method, int(st.session_state.get("workers", 1)))
         for page in all_pages:
-            print(page)
-            st.session_state.pages[page['page'] - 1][page["method"]] = page[extraction_method]
-            del page["method"]
+            st.session_state.pages[page['page'] - 1][page["method"]] = page["text"]
+        mark_dirty(sorted({page['page'] - 1 for page in all_pages}))
 
     def parse_page():
         #print('going to parse page', st.session_state.page_num)
         x = st.session_state.col_center if "col_center" in st.session_state else 0
-        p = processor.parse_single_page(st.session_state.page_num, extraction_method, int(x))
+        with metrics.span("parse_page", st.session_state.page_num - 1, extraction_method, processor.doc_hash):
+            if extraction_method == "hybrid":
+                p, route, reason = processor.parse_hybrid_page(st.session_state.page_num, int(x))
+            else:
+                p = processor.parse_single_page(st.session_state.page_num, extraction_method, int(x))
+        metrics.write()
         st.session_state.pages[st.session_state.page_num - 1][extraction_method] = p
-
-    def remove_diacritics(txt):
-        import re
-        diacritics = ''.join([chr(x) for x in list(range(0x64b, 0x652)) + [1648, 1618]])
-        return re.sub(' ?[' + diacritics + ']+', '', txt)
+        if extraction_method == "hybrid":
+            st.session_state.pages[st.session_state.page_num - 1]["hybrid_route"] = route
+            st.session_state.pages[st.session_state.page_num - 1]["hybrid_reason"] = reason
+        mark_dirty([st.session_state.page_num - 1])
+
+    def relayout_page():
+        # rebuilds the page from its stored line boxes, no OCR
+        x = int(st.session_state.get("col_center") or 0)
+        text = processor.relayout(st.session_state.page_num, extraction_method, x)
+        if text is not None:
+            st.session_state.pages[st.session_state.page_num - 1][extraction_method] = text
+            reset_page_text([st.session_state.page_num - 1])
+            mark_dirty([st.session_state.page_num - 1])
+
+    def reset_page_text(page_indices):
+        # the text area keeps its own copy of a visited page, drop it so the edited text is shown
+        for i in page_indices:
+            if f"page_text_{i + 1}" in st.session_state:
+                del st.session_state[f"page_text_{i + 1}"]
+
+    def bulk_edit(label, edit):
+        if st.session_state.edit_scope == "Whole book":
+            page_indices = range(len(st.session_state.pages))
+        elif st.session_state.edit_scope == "Page range":
+            page_indices = range(int(st.session_state.edit_from) - 1, min(int(st.session_state.edit_to), len(st.session_state.pages)))
+        else:
+            page_indices = [st.session_state.page_num - 1]
+        changed = st.session_state.edit_journal.apply(label, st.session_state.pages, page_indices, extraction_method, edit)
+        reset_page_text(changed)
+        mark_dirty(changed)
 
     def set_human_page():
         st.session_state.first_human_page = st.session_state.page_num
@@ -401,23 +576,47 @@ def main():
     with st.sidebar:
         with st.expander("Configuration:", expanded=False):
             #st.header("Configuration")
-            extraction_methods = ["gemini-2-flash", "pdfplumber", "tesseract", "PyMuPDF", "surya"] #, "pdf2image/tesseract"]
-            try:
-                #import doctr
-                #extraction_methods.extend(["doctr (OCR)", "All Methods"])
-                pass
-            except ImportError:
-                pass
+            extraction_methods = processor.backends.names()
             
-            extraction_method = st.radio("Select Extraction Method", extraction_methods)
-
+            selected_method = st.radio("Select Extraction Method", extraction_methods + ["All Methods"])
+            compared_methods = [selected_method]
+            extraction_method = selected_method
+            if selected_method == "All Methods":
+                # every page is rendered once for all engines, the text of one of them is shown and edited
+                compared_methods = st.multiselect("Compared methods:", COMPARE_METHODS, default=["pdfplumber", "PyMuPDF", "tesseract"],
+                    key="compare_methods", help='Engines run on each page side by side, with their timings')
+                extraction_method = st.selectbox("Show text of:", compared_methods or COMPARE_METHODS, key="compare_view")
+            for method in compared_methods:
+                if not processor.backends.is_loaded(method):
+                    with st.spinner(f"Loading {method}..."):
+                        processor.backends.get(method)
+            st.caption("Backend load times: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in processor.backends.load_times.items()))
+
+            if extraction_method in ["pdfplumber", "PyMuPDF", "tesseract", "hybrid"]:
+                st.number_input("Parse All workers:", min_value=1, max_value=os.cpu_count() or 1,
+                    value=min(int(os.getenv('EXTRACT_WORKERS', 1)), os.cpu_count() or 1), key="workers",
+                    help='Number of processes used to parse all pages')
+
+            st.number_input("Prefetch pages:", min_value=0, max_value=20, value=int(os.getenv('PREFETCH_PAGES', 2)), key="prefetch_pages",
+                help='Pages before and after the current one extracted in the background')
+            if extraction_method not in ["pdfplumber", "PyMuPDF", "tesseract"]:
+                st.checkbox("Prefetch with this method", value=st.session_state.prefetcher.ocr, key="prefetch_ocr",
+                    help='Also extract the prefetched pages with OCR / Gemini, otherwise they are only rendered (paid, rate limited requests)')
+                st.session_state.prefetcher.ocr = st.session_state.prefetch_ocr
+
+            if extraction_method == "gemini-2-flash":
+                st.number_input("Requests in flight:", min_value=1, max_value=32, value=int(os.getenv('GEMINI_IN_FLIGHT', 4)), key="gemini_in_flight",
+                    help='Concurrent Gemini requests for Parse All, limited by GEMINI_RPM and GEMINI_TPM')
+
+            if extraction_method in ["surya", "tesseract", "PyMuPDF"]:
+                st.number_input("2 col center X:", key="col_center", on_change=relayout_page,
+                    help='Column split in page pixels (click the page to read it), 0 detects the columns')
+            if extraction_method in ["surya", "tesseract", "gemini-2-flash", "hybrid"]:
+                processor.preprocess = st.checkbox("Preprocess page images", value=processor.preprocess, key="ocr_preprocess",
+                    help='Render each page at a scale picked from its text height, binarise, deskew and crop the margins before OCR')
             if extraction_method == "surya":
-                if not hasattr(processor, 'surya_det_processor') or \
-                    not hasattr(processor, 'surya_det_model') or \
-                    not hasattr(processor, 'surya_rec_model') or \
-                    not hasattr(processor, 'surya_rec_processor'):
-                    processor.load_surya()
-                st.number_input("2 col center X:", key="col_center")
+                st.number_input("Surya batch size:", min_value=1, max_value=64, value=int(os.getenv('SURYA_BATCH_SIZE', 8)), key="surya_batch_size",
+                    help='Pages sent to surya at once by Parse All')
             
             #uploaded_file = st.sidebar.file_uploader("Choose a PDF file", type="pdf", key=st.session_state["uploader_pdf_key"])
 
@@ -451,8 +650,11 @@ def main():
                     )
                     st.text('Current human page number: ' + str(st.session_state.page_num - st.session_state.first_human_page + 1 if (st.session_state.first_human_page > 0 and st.session_state.page_num - st.session_state.first_human_page >= 0) else -1))
                     st.text('First human page (offset): ' + str(st.session_state.first_human_page))
-                    for page in st.session_state.pages:
-                        page['human_page'] = page["page"] - st.session_state.first_human_page + 1 if (st.session_state.first_human_page != -1 and page["page"] - st.session_state.first_human_page >= 0) else -1
+                    if st.session_state.get("human_page_offset") != (st.session_state.first_human_page, len(st.session_state.pages)):
+                        # only recomputed when the offset (or the page list) changes
+                        st.session_state.pages.set_first_human_page(st.session_state.first_human_page)
+                        st.session_state.human_page_offset = (st.session_state.first_human_page, len(st.session_state.pages))
+                        mark_dirty(range(len(st.session_state.pages)))
                 else:
                     st.warning(f"No text extracted for page {st.session_state.page_num}")
                 
@@ -461,52 +663,52 @@ def main():
     if uploaded_file is not None:
         with st.sidebar:
             with st.expander("Edit:", expanded=False):
-                if st.button('Remove diacritics', help='Remove diacritics from this page'):
-                    if "edited_text" in st.session_state.pages[st.session_state.page_num - 1]:
-                        st.session_state.pages[st.session_state.page_num - 1]["edited_text"] = remove_diacritics(st.session_state.pages[st.session_state.page_num - 1]["edited_text"])
-                    else:
-                        st.session_state.pages[st.session_state.page_num - 1]["edited_text"] = remove_diacritics(st.session_state.pages[st.session_state.page_num - 1][extraction_method])
+                st.radio("Apply to:", ["This page", "Page range", "Whole book"], key="edit_scope", horizontal=True)
+                if st.session_state.edit_scope == "Page range":
+                    range_col1, range_col2 = st.columns(2)
+                    range_col1.number_input("From", min_value=1, max_value=max(1, st.session_state.total_pages), value=1, key="edit_from")
+                    range_col2.number_input("To", min_value=1, max_value=max(1, st.session_state.total_pages), value=max(1, st.session_state.total_pages), key="edit_to")
+
+                if st.button('Remove diacritics', help='Remove diacritics from the selected pages'):
+                    bulk_edit("Remove diacritics", remove_diacritics_edit())
                 st.text_input(label="To Replace:", placeholder="To replace", key="to_replace")
                 st.text_input(label="Replace with:", placeholder="Replace with", key="replace_with")
                 if st.button('Replace') and \
                     "to_replace" in st.session_state and st.session_state["to_replace"] != "" and \
                     "replace_with" in st.session_state:
-
-                    if "edited_text" in st.session_state.pages[st.session_state.page_num - 1]:
-                        st.session_state.pages[st.session_state.page_num - 1]["edited_text"] = st.session_state.pages[st.session_state.page_num - 1]["edited_text"].replace(st.session_state["to_replace"], st.session_state["replace_with"])
-                    else:
-                        st.session_state.pages[st.session_state.page_num - 1]["edited_text"] = st.session_state.pages[st.session_state.page_num - 1][extraction_method].replace(st.session_state["to_replace"], st.session_state["replace_with"])
+                    bulk_edit("Replace", replace_edit(st.session_state["to_replace"], st.session_state["replace_with"]))
                 
                 if st.button('Glue Chars', help='Convert contextual character form to general form (in Arabic scripts)'):
-                    if "edited_text" in st.session_state.pages[st.session_state.page_num - 1]:
-                        st.session_state.pages[st.session_state.page_num - 1]["edited_text"] = normalize(st.session_state.pages[st.session_state.page_num - 1]["edited_text"])
-                    else:
-                        st.session_state.pages[st.session_state.page_num - 1]["edited_text"] = normalize(st.session_state.pages[st.session_state.page_num - 1][extraction_method])
+                    bulk_edit("Glue Chars", glue_edit())
+
+                if st.session_state.edit_journal.can_undo():
+                    if st.button(f'Undo "{st.session_state.edit_journal.last_label()}"'):
+                        reverted, skipped = st.session_state.edit_journal.undo(st.session_state.pages)
+                        reset_page_text(reverted)
+                        mark_dirty(reverted)
+                        if skipped:
+                            st.warning(f"{len(skipped)} page(s) were edited afterwards and were not reverted")
 
         # Store filename in session state
         st.session_state.uploaded_filename = uploaded_file.name
 
-        # Process PDF only if it's a new file or extraction method changed
-        file_contents = uploaded_file.getvalue()
-        current_file_hash = hash(file_contents)
-        
-        if ('file_hash' not in st.session_state or 
-            st.session_state.file_hash != current_file_hash or
-            'extraction_method' not in st.session_state or
-            st.session_state.extraction_method != extraction_method):
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                tmp_file.write(file_contents)
-                processor.temp_pdf_path = tmp_file.name
+        # Hash and spool the PDF once per upload, reruns and method changes reuse it
+        upload_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+        if st.session_state.get('upload_id') != upload_id:
+            spool = get_upload_spool()
+            file_hash, processor.temp_pdf_path = spool.store(uploaded_file.getbuffer())
             
             # Load document and process PDF
-            st.session_state.total_pages = processor.load_document(processor.temp_pdf_path)
+            st.session_state.total_pages = processor.load_document(processor.temp_pdf_path, file_hash)
+            spool.gc(keep=get_document_pool().digests())
             if len(st.session_state['pages']) == 0:
-                st.session_state['pages'] = [{"page": x, "isData": True} for x in range(1, st.session_state.total_pages + 1)]
+                st.session_state['pages'] = PageStore(st.session_state.total_pages)
             #if st.session_state.parse_pdf:            
                 #st.session_state.results = process_pdf(processor, processor.temp_pdf_path, extraction_method)
-            st.session_state.file_hash = current_file_hash
-            st.session_state.extraction_method = extraction_method
+            st.session_state.file_hash = file_hash
+            st.session_state.upload_id = upload_id
+            open_session_journal(processor.doc_hash)
+        st.session_state.extraction_method = extraction_method
         
         # Navigation controls
         st.sidebar.header("Navigation")
@@ -551,17 +753,29 @@ def main():
         col2.button("◀", on_click=prev_page)
         col3.button("▶", on_click=next_page)
         col4.button("⏭️", on_click=last_page)
+
+        st.session_state.prefetcher.schedule(
+            st.session_state.page_num, extraction_method,
+            int(st.session_state.get("col_center") or 0), int(st.session_state.get("prefetch_pages", 2))
+        )
+
+        jump_queue(processor, extraction_method)
+        with st.sidebar:
+            st.fragment(show_jobs, run_every=float(os.getenv('JOB_POLL_SECONDS', 1)) if st.session_state.jobs else None)(processor, extraction_method)
         
         is_data_key = f"is_data_page_{st.session_state.page_num}"
         is_data_page = st.session_state['pages'][st.session_state.page_num - 1]["isData"] if "isData" in st.session_state['pages'][st.session_state.page_num - 1] else False
         is_data = st.sidebar.toggle("Non-data / Data page", value=is_data_page , key=is_data_key)
-        st.session_state['pages'][st.session_state.page_num - 1]["isData"] = is_data
+        if st.session_state['pages'][st.session_state.page_num - 1].get("isData") != is_data:
+            st.session_state['pages'][st.session_state.page_num - 1]["isData"] = is_data
+            mark_dirty([st.session_state.page_num - 1])
 
         data_type_key = f"data_type_page_{st.session_state.page_num}"
         #data_type_page = st.session_state['pages'][st.session_state.page_num - 1]["dataType"] if "dataType" in st.session_state['pages'][st.session_state.page_num - 1] else False
         def set_data_type(key):
             if key in st.session_state:
                 st.session_state['pages'][st.session_state.page_num - 1]["dataType"] = st.session_state[key]
+                mark_dirty([st.session_state.page_num - 1])
         if is_data:
             if "dataType" in st.session_state['pages'][st.session_state.page_num - 1]:
                 st.session_state[data_type_key] = st.session_state['pages'][st.session_state.page_num - 1]["dataType"]
@@ -575,10 +789,23 @@ def main():
         to_review_key = f"to_reiew_page_{st.session_state.page_num}"
         to_review_page = st.session_state['pages'][st.session_state.page_num - 1]["toReview"] if "toReview" in st.session_state['pages'][st.session_state.page_num - 1] else False
         to_review = st.sidebar.toggle("Need Review", value=to_review_page , key=to_review_key)
-        st.session_state['pages'][st.session_state.page_num - 1]["toReview"] = to_review
+        if st.session_state['pages'][st.session_state.page_num - 1].get("toReview") != to_review:
+            st.session_state['pages'][st.session_state.page_num - 1]["toReview"] = to_review
+            mark_dirty([st.session_state.page_num - 1])
 
         # Add download button to sidebar
         #st.sidebar.markdown("---")
+        if selected_method == "All Methods" and st.session_state.compare_timings:
+            page_timings = st.session_state.compare_timings.get(st.session_state.page_num - 1)
+            if page_timings:
+                st.sidebar.caption("Page timings: " + ", ".join(f"{method} {seconds:.2f}s" for method, seconds in page_timings.items()))
+            with st.sidebar.expander("Method timings", expanded=False):
+                st.dataframe(compare_summary(st.session_state.compare_timings), hide_index=True)
+
+        if extraction_method == "hybrid" and "hybrid_route" in st.session_state['pages'][st.session_state.page_num - 1]:
+            page = st.session_state['pages'][st.session_state.page_num - 1]
+            st.sidebar.caption(f"Extracted with {page['hybrid_route']} ({page.get('hybrid_reason', '')})")
+
         st.sidebar.header("Export")
         #download_json_button()
 
@@ -586,7 +813,12 @@ def main():
         #st.sidebar.subheader("Session Management")
         
         # Save button
+        if st.session_state.session_journal.mark_meta(session_meta()):
+            st.session_state.pop("export_json", None)
         save_session_state()
+        if st.session_state.get("autosave"):
+            st.sidebar.button(f"Restore autosave ({len(st.session_state.autosave[0])} pages)", on_click=restore_autosave,
+                help='Pages and index saved automatically the last time this PDF was open')
 
         
         # Display content
@@ -598,19 +830,27 @@ def main():
             
             # Always update the edited_texts dictionary when text changes
             st.session_state["pages"][page_num-1]["edited_text"] = new_text
+            mark_dirty([page_num-1])
 
         def get_current_page_text():
-            page_key = f"{st.session_state.page_num}"
-
-            if "edited_text" in st.session_state["pages"][st.session_state.page_num-1]:
+            edited = st.session_state.pages.get(st.session_state.page_num, "edited_text")
+            if edited is not None:
                 #st.session_state["parse_page"] = False
-                return st.session_state["pages"][st.session_state.page_num-1]["edited_text"]
-
-            if st.session_state.pages:
-                for page in st.session_state.pages:
-                    if page['page'] == st.session_state.page_num and extraction_method in page:
-                        st.session_state["parse_page"] = False
-                        return page[extraction_method]
+                return edited
+
+            text = st.session_state.pages.get(st.session_state.page_num, extraction_method)
+            if text is not None:
+                st.session_state["parse_page"] = False
+                return text
+
+            # extracted earlier or by the prefetcher
+            x = st.session_state.get("col_center") or 0
+            cached = processor.cached_page_text(st.session_state.page_num, extraction_method, int(x))
+            if cached is not None:
+                st.session_state["pages"][st.session_state.page_num-1][extraction_method] = cached
+                mark_dirty([st.session_state.page_num-1])
+                st.session_state["parse_page"] = False
+                return cached
 
             st.session_state["parse_page"] = True
             return "No text available"
@@ -643,19 +883,14 @@ def main():
             )
             #st.session_state.zoom_level = zoom_level
 
-            page = processor.doc.load_page(st.session_state.page_num - 1)
-            #pix = page.get_pixmap()
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_bytes = pix.tobytes("png")
+            # rendered for the zoom level and compressed, the encoded bytes are cached
+            mime, img_bytes = processor.viewer_image(st.session_state.page_num - 1, zoom_level)
 
             # Convert image bytes to base64 for embedding in HTML
             img_base64 = base64.b64encode(img_bytes).decode()
 
             # Embed image in custom HTML with JavaScript for zoom control
-            #custom_html = f""""""
-            with open("custom_html.html",'r') as f: 
-                custom_html = f.read()
-            custom_html = custom_html.format(zoom_level=zoom_level, img_base64=img_base64)
+            custom_html = VIEWER_TEMPLATE.format(zoom_level=zoom_level, img_base64=img_base64, mime=mime)
             st.components.v1.html(custom_html, height=650, scrolling=False)
 
             #st.image(img_bytes, use_column_width=True)
@@ -665,6 +900,10 @@ def main():
             st.subheader("Page text:")
             
             text_key = f"page_text_{st.session_state.page_num}"
+            # only the open page keeps a text area copy, edits are already in the page store
+            if st.session_state.get("text_area_key", text_key) != text_key and st.session_state.text_area_key in st.session_state:
+                del st.session_state[st.session_state.text_area_key]
+            st.session_state.text_area_key = text_key
 
             current_text = get_current_page_text()
 
@@ -730,7 +969,8 @@ def main():
     if os.getenv('DEBUG', 'False').lower() in ('true'):
         with st.expander("Debug Information", expanded=True):
             if len(st.session_state.pages) > 0:
-                st.write('Current page: ', st.session_state.pages[st.session_state.page_num-1])
+                st.write('Current page: ', dict(st.session_state.pages[st.session_state.page_num-1]))
+                st.write('Stored texts (slots, distinct, characters): ', st.session_state.pages.text_stats())
             st.write('keywords: ', st.session_state.keywords)
             if "keywords_edited" in st.session_state:
                 st.write('keywords_edited: ', st.session_state.keywords_edited)
@@ -742,6 +982,16 @@ def main():
                 st.write('types_edited: ', st.session_state.types_edited)
             st.write("SESSION: ", st.session_state)
 
+    if os.getenv('METRICS_PANEL', 'False').lower() in ('true', '1'):
+        with st.expander("Pipeline timings", expanded=False):
+            # stage seconds of this document's slowest pages, from the spans still in memory
+            st.dataframe(metrics.slowest_pages(int(os.getenv('METRICS_SLOWEST', 10)), processor.doc_hash), hide_index=True)
+            st.dataframe(metrics.counter_rows(), hide_index=True)
+            st.write('Caches: ', metrics.collected())
+            col1, col2 = st.columns(2)
+            col1.download_button("Prometheus metrics", metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+            col2.download_button("JSON metrics", metrics.to_json(), file_name="metrics.json", mime="application/json")
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,345 @@
+# Extraction benchmark over synthetic Persian/Arabic PDFs generated with fitz.
+# python benchmarks/bench_extract.py [--pages 20] [--methods PyMuPDF,pdfplumber,tesseract] [--output results.json]
+# python benchmarks/bench_extract.py --baseline results.json   # flags regressions against a stored run
+#
+# every case runs in a fresh process with the extraction cache disabled, so timings are cold and the
+# peak RSS is the case's own. gemini is measured against gemini_stub.py on a local port.
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+from ExtractionCache import ExtractionCache
+from TextNormalizer import TextNormalizer
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+FONT = os.getenv('BENCH_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+LAYOUTS = ["single", "two_column", "image_only", "presentation", "mixed"]
+METHODS = ["PyMuPDF", "pdfplumber", "tesseract", "pdf2image/tesseract", "surya", "gemini-2-flash", "hybrid"]
+NORMALIZERS = {
+    "glue": ["glue"],
+    "diacritics": ["diacritics"],
+    "justifies_lefties": ["digits", "lefties"],
+    "adjust_plumber_text": ["plumber", "digits"],
+}
+# (metric, True when higher is better)
+METRICS = [("pages_per_s", True), ("p90_ms", False), ("peak_rss_mb", False)]
+
+WORDS = ("کتاب درس فصل پرسش پاسخ دانش آموز معلم مدرسه زبان فارسی ادبیات شعر نثر تاریخ ایران جهان علم "
+         "ریاضی هندسه عدد جمله متن صفحه خواندن نوشتن یادگیری تمرین نمونه مثال توضیح بخش پایان آغاز "
+         "و در از به با که این آن را برای است بود شد").split()
+DIGITS = "۰۱۲۳۴۵۶۷۸۹"
+# isolated presentation forms, the glyphs some PDFs put in their text layer instead of letters
+PRESENTATION = str.maketrans({
+    'ا': 'ﺍ', 'ب': 'ﺏ', 'ت': 'ﺕ', 'ث': 'ﺙ', 'ج': 'ﺝ', 'ح': 'ﺡ', 'خ': 'ﺥ',
+    'د': 'ﺩ', 'ذ': 'ﺫ', 'ر': 'ﺭ', 'ز': 'ﺯ', 'س': 'ﺱ', 'ش': 'ﺵ', 'ص': 'ﺹ',
+    'ع': 'ﻉ', 'ف': 'ﻑ', 'ق': 'ﻕ', 'ل': 'ﻝ', 'م': 'ﻡ', 'ن': 'ﻥ', 'ه': 'ﻩ',
+    'و': 'ﻭ', 'ی': 'ﯼ', 'ک': 'ﮎ', 'گ': 'ﮒ', 'پ': 'ﭖ', 'چ': 'ﭺ',
+})
+
+
+def make_line(rng, words):
+    line = [rng.choice(WORDS) for _ in range(words)]
+    if rng.random() < 0.2:
+        line.insert(rng.randrange(len(line)), ''.join(rng.choice(DIGITS) for _ in range(rng.randint(1, 3))))
+    return ' '.join(line)
+
+
+def write_text(page, rng, kind):
+    page.insert_font(fontname='bench', fontfile=FONT)
+    top, bottom = 60, page.rect.height - 60
+    if kind == "two_column":
+        columns = [(page.rect.width / 2 + 15, page.rect.width - 40), (40, page.rect.width / 2 - 15)]
+        words = (3, 6)
+    else:
+        columns = [(40, page.rect.width - 40)]
+        words = (8, 13)
+    for x0, _ in columns:
+        y = top
+        while y < bottom:
+            line = make_line(rng, rng.randint(*words))
+            if kind == "presentation":
+                line = line.translate(PRESENTATION)
+            page.insert_text((x0, y), line, fontname='bench', fontsize=12)
+            y += 22
+
+
+def make_pdf(path, layout, pages, seed=0):
+    # deterministic for a seed (and fitz version); mixed cycles through the other layouts
+    rng = random.Random(f'{layout}-{seed}')
+    doc = fitz.open()
+    for i in range(pages):
+        kind = LAYOUTS[i % 4] if layout == "mixed" else layout
+        if kind == "image_only":
+            # a text page rasterised and placed as the only content, no text layer
+            scratch = fitz.open()
+            source = scratch.new_page()
+            write_text(source, rng, "single")
+            pix = source.get_pixmap(matrix=fitz.Matrix(2, 2))
+            page = doc.new_page(width=source.rect.width, height=source.rect.height)
+            page.insert_image(page.rect, pixmap=pix)
+            scratch.close()
+        else:
+            write_text(doc.new_page(), rng, kind)
+    doc.set_metadata({}) # no creation date, the same seed gives the same bytes
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def make_corpus(directory, layouts, pages, seed=0):
+    corpus = {}
+    for layout in layouts:
+        path = os.path.join(directory, f"{layout}-{pages}-{seed}.pdf")
+        make_pdf(path, layout, pages, seed)
+        with open(path, 'rb') as f:
+            corpus[layout] = {"path": path, "sha256": hashlib.sha256(f.read()).hexdigest()}
+    return corpus
+
+
+def peak_rss_mb(who):
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(latencies, seconds):
+    latencies = np.asarray(latencies) * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) if len(latencies) else (0, 0, 0)
+    return {
+        "pages": len(latencies),
+        "seconds": round(seconds, 4),
+        "pages_per_s": round(len(latencies) / seconds, 2) if seconds else 0.0,
+        "p50_ms": round(float(p50), 2),
+        "p90_ms": round(float(p90), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(latencies.max()), 2) if len(latencies) else 0.0,
+    }
+
+
+def measure(kind, name, pdf_path, workers=1, rounds=1):
+    # batch: iter_pages, which every process_with_* is a list() of, timed per page as records arrive;
+    # page: parse_single_page on every page; normalize: a TextNormalizer over the PyMuPDF text, rounds times
+    from PDFProcessor import PDFProcessor
+    processor = PDFProcessor(cache=ExtractionCache(max_mb=0))
+    result = {}
+    if kind != "normalize":
+        start = time.perf_counter()
+        processor.backends.get(name)
+        result["load_s"] = round(time.perf_counter() - start, 3)
+    page_count = processor.load_document(pdf_path)
+    processor.temp_pdf_path = pdf_path
+
+    latencies = []
+    if kind == "normalize":
+        texts = [processor.page_text(page_num) for page_num in range(page_count)]
+        normalizer = TextNormalizer(NORMALIZERS[name])
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                began = time.perf_counter()
+                normalizer.normalize(text)
+                latencies.append(time.perf_counter() - began)
+    elif kind == "page":
+        start = time.perf_counter()
+        for page in range(1, page_count + 1):
+            began = time.perf_counter()
+            processor.parse_single_page(page, name)
+            latencies.append(time.perf_counter() - began)
+    else:
+        start = last = time.perf_counter()
+        for _ in processor.iter_pages(name, workers=workers):
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last = now
+    result.update(summarize(latencies, time.perf_counter() - start))
+    processor.cleanup(remove_file=False)
+    result["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+    result["peak_child_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+    return result
+
+
+def run_case(case, pdf_path, workers, rounds, results):
+    try:
+        results.put(measure(case[0], case[1], pdf_path, workers, rounds))
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(case, pdf_path, workers=1, rounds=1, timeout=None):
+    # spawned, not forked: nothing of the parent's memory counts towards the case. a child that dies in a
+    # native backend (tesseract, surya OOM, poppler) or runs past timeout is reported as a failed case
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_case, args=(case, pdf_path, workers, rounds, results))
+    process.start()
+    deadline = time.monotonic() + timeout if timeout else None
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    # put just before exiting
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    result = {"error": f"process exited with code {process.exitcode}"}
+            elif deadline and time.monotonic() > deadline:
+                process.kill()
+                result = {"error": f"timed out after {timeout:.0f}s"}
+    process.join()
+    return result
+
+
+def start_gemini_stub(latency):
+    import gemini_stub
+    server = gemini_stub.serve(0, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['GEMINI_BASE_URL'] = f'http://127.0.0.1:{server.server_address[1]}'
+    os.environ.setdefault('GOOGLE_API_KEY', 'stub')
+    os.environ.setdefault('GEMINI_MODEL', 'gemini-2.0-flash')
+    # the stub has no quota, measure the request pipeline rather than the limiter
+    os.environ['GEMINI_RPM'] = os.environ['GEMINI_TPM'] = str(10 ** 9)
+    return server
+
+
+def cases_for(methods, layouts, page_layout):
+    from PDFProcessor import SINGLE_PAGE_METHODS
+    cases = [("batch", method, layout) for method in methods for layout in layouts]
+    if page_layout in layouts:
+        # parse_single_page returns None at once for the others, which would read as a very fast case
+        cases += [("page", method, page_layout) for method in methods if method in SINGLE_PAGE_METHODS]
+    if "single" in layouts:
+        cases += [("normalize", name, "single") for name in NORMALIZERS]
+    return cases
+
+
+def compare(results, baseline, threshold):
+    # (case, metric, baseline value, value) for every metric worse than the baseline by more than threshold
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or "error" in result or "error" in previous:
+            continue
+        for metric, higher_is_better in METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def print_table(results, baseline=None):
+    print(f"{'case':<42}{'pages/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'rss MB':>9}{'vs base':>10}")
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<42}  {result['error']}")
+            continue
+        vs = ''
+        previous = (baseline or {}).get("results", {}).get(name, {})
+        if previous.get("pages_per_s"):
+            vs = f"{(result['pages_per_s'] / previous['pages_per_s'] - 1) * 100:+.1f}%"
+        rss = result["peak_rss_mb"] if result["peak_rss_mb"] is not None else '-'
+        print(f"{name:<42}{result['pages_per_s']:>10.2f}{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{rss:>9}{vs:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=20, help='pages per synthetic PDF')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--methods', default=','.join(METHODS))
+    parser.add_argument('--layouts', default=','.join(LAYOUTS))
+    parser.add_argument('--page-layout', default='mixed', help='layout parse_single_page is measured on')
+    parser.add_argument('--workers', type=int, default=1, help='workers passed to iter_pages')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case, the fastest is kept')
+    parser.add_argument('--normalize-rounds', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=1800, help='seconds a case may run before it is counted as failed')
+    parser.add_argument('--gemini-latency', type=float, default=0.2, help='seconds the gemini stub takes per request')
+    parser.add_argument('--corpus-dir', help='where the PDFs are written, a temp dir by default')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if not os.path.exists(FONT):
+        parser.error(f'font {FONT} not found, point BENCH_FONT at a TTF with Arabic glyphs')
+    methods = [m for m in args.methods.split(',') if m]
+    layouts = [layout for layout in args.layouts.split(',') if layout]
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='bench-extract-')
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = make_corpus(corpus_dir, layouts, args.pages, args.seed)
+    print(f'corpus: {corpus_dir}')
+
+    server = start_gemini_stub(args.gemini_latency) if "gemini-2-flash" in methods else None
+    results = {}
+    try:
+        for case in cases_for(methods, layouts, args.page_layout):
+            name = '/'.join(case)
+            runs = [run_isolated(case, corpus[case[2]]["path"], args.workers, args.normalize_rounds, args.timeout) for _ in range(args.repeat)]
+            ok = [run for run in runs if "error" not in run]
+            results[name] = max(ok, key=lambda run: run["pages_per_s"]) if ok else runs[0]
+            print(f'{name}: {results[name].get("pages_per_s", results[name].get("error"))}')
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        "meta": {
+            "date": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pymupdf": fitz.VersionBind,
+            "pages": args.pages,
+            "seed": args.seed,
+            "workers": args.workers,
+            "corpus": {layout: entry["sha256"] for layout, entry in corpus.items()},
+        },
+        "results": results,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'results written to {args.output}')
+
+    if baseline is not None:
+        stored = baseline["meta"].get("corpus", {})
+        if any(stored.get(layout, sha256) != sha256 for layout, sha256 in report["meta"]["corpus"].items()):
+            print('warning: the baseline was measured on a different corpus (pages, seed or PyMuPDF version)')
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, old, new in regressions:
+            print(f'REGRESSION {name} {metric}: {old} -> {new}')
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions beyond {args.threshold:.0%}')
+
+
+if __name__ == "__main__":
+    main()
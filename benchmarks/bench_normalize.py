@@ -0,0 +1,87 @@
+# Micro-benchmark of TextNormalizer against the per-call implementations it replaced.
+# python benchmarks/bench_normalize.py [--pages 400] [--repeat 5]
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from TextNormalizer import TextNormalizer, GLUE_SRC, GLUE_TRG, FARSI_DIGITS, LATIN_DIGITS, DIACRITICS
+
+
+# previous implementations, kept here as the reference
+def legacy_normalize(text):
+    repl = str.maketrans(GLUE_SRC, GLUE_TRG)
+    repl[172] = 8204
+    return text.translate(repl)
+
+
+def legacy_remove_diacritics(txt):
+    diacritics = ''.join([chr(x) for x in list(range(0x64b, 0x652)) + [1648, 1618]])
+    return re.sub(' ?[' + diacritics + ']+', '', txt)
+
+
+LEGACY_REPL = str.maketrans(FARSI_DIGITS, LATIN_DIGITS)
+
+
+def legacy_reverse_match(match):
+    return match.group(0)[::-1]
+
+
+def legacy_justifies_lefties(txt):
+    new_txt = txt.translate(LEGACY_REPL)
+    new_txt = re.sub('[A-Za-z' + string.punctuation + ']+', legacy_reverse_match, new_txt)
+    new_txt = re.sub(r'\d+', legacy_reverse_match, new_txt)
+    return new_txt
+
+
+def legacy_adjust_plumber_text(text):
+    tmp = [x.translate(LEGACY_REPL) for x in ''.join(list(reversed(list(text)))).split("\n")[::-1]]
+    return '\n'.join(tmp)
+
+
+def make_pages(count, seed=0):
+    rng = random.Random(seed)
+    alphabet = GLUE_SRC + GLUE_TRG + FARSI_DIGITS + DIACRITICS + 'abcXYZ019().,:' + '¬' + '      '
+    pages = []
+    for _ in range(count):
+        lines = [''.join(rng.choice(alphabet) for _ in range(rng.randint(20, 80))) for _ in range(40)]
+        pages.append('\n'.join(lines))
+    return pages
+
+
+CASES = [
+    ("glue", legacy_normalize, ["glue"]),
+    ("diacritics", legacy_remove_diacritics, ["diacritics"]),
+    ("justifies_lefties", legacy_justifies_lefties, ["digits", "lefties"]),
+    ("adjust_plumber_text", legacy_adjust_plumber_text, ["plumber", "digits"]),
+    ("glue+diacritics", lambda t: legacy_remove_diacritics(legacy_normalize(t)), ["glue", "diacritics"]),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    pages = make_pages(args.pages)
+
+    print(f"{'case':<22}{'legacy ms':>12}{'engine ms':>12}{'batch ms':>12}{'speedup':>10}")
+    for name, legacy, steps in CASES:
+        engine = TextNormalizer(steps)
+        expected = [legacy(p) for p in pages]
+        assert [engine.normalize(p) for p in pages] == expected, name
+        assert engine.normalize_many(pages) == expected, name
+
+        legacy_s = min(timeit.repeat(lambda: [legacy(p) for p in pages], number=1, repeat=args.repeat))
+        engine_s = min(timeit.repeat(lambda: [engine.normalize(p) for p in pages], number=1, repeat=args.repeat))
+        batch_s = min(timeit.repeat(lambda: engine.normalize_many(pages), number=1, repeat=args.repeat))
+        print(f"{name:<22}{legacy_s * 1000:>12.2f}{engine_s * 1000:>12.2f}{batch_s * 1000:>12.2f}{legacy_s / min(engine_s, batch_s):>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Local stand-in for the Gemini generateContent endpoint, for testing and benchmarking offline.
+# python gemini_stub.py --port 8765 and set GEMINI_BASE_URL=http://localhost:8765
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(latency, error_rate, text):
+    class GeminiStubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            time.sleep(latency)
+
+            if ':generateContent' not in self.path:
+                self.send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+            elif random.random() < error_rate:
+                self.send_json(429, {"error": {"code": 429, "message": "quota exceeded", "status": "RESOURCE_EXHAUSTED"}})
+            else:
+                self.send_json(200, {
+                    "candidates": [{
+                        "content": {"parts": [{"text": text}], "role": "model"},
+                        "finishReason": "STOP",
+                    }],
+                    "usageMetadata": {"promptTokenCount": 270, "candidatesTokenCount": 200, "totalTokenCount": 470},
+                })
+
+        def send_json(self, status, body):
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return GeminiStubHandler
+
+
+def serve(port=8765, latency=0.5, error_rate=0.0, text="متن آزمایشی صفحه"):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(latency, error_rate, text))
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 429')
+    args = parser.parse_args()
+    print(f'gemini stub listening on http://127.0.0.1:{args.port}')
+    serve(args.port, args.latency, args.error_rate).serve_forever()